@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+import argparse
+import hashlib
+import json
+import os
+import re
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "actual_data", "europe")
+
+def file_date(fname):
+    """Date of a daily download, from its file name (e.g. EU_UK_data_download_2020-03-06_073001_-0500.csv)"""
+    return np.datetime64(re.search(r"\d{4}-\d{2}-\d{2}", fname).group(0), "D")
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def read_file(path):
+    """One daily file as (countries, cases, deaths) arrays"""
+    df = pd.read_csv(path)
+    country_col = df.columns[0] # The header of the country column changes between downloads
+    return df[country_col].to_numpy(dtype=str), df["Cases"].to_numpy(np.int64), df["Deaths"].to_numpy(np.int64)
+
+class ActualData(object):
+    """Cumulative Cases and Deaths for every country in a directory of daily files, as a (Date, Country) table
+
+    The parsed rows are cached column by column in an .npz beside the
+    directory, with each file's mtime, size and hash. update() only parses
+    files that are new or whose contents changed, and drops rows of files
+    that were removed, so adding a daily file costs one parse.
+    """
+
+    def __init__(self, path=DATA_PATH, cache_path=None):
+        super(ActualData, self).__init__()
+        self.path = path
+        self.cache_path = cache_path if cache_path is not None else os.path.normpath(path) + ".cache.npz"
+        self.files = {} # File name -> {"mtime_ns", "size", "sha1"}
+        self.columns = {"source" : np.zeros(0, dtype="U"), "date" : np.zeros(0, dtype="datetime64[D]"),
+            "country" : np.zeros(0, dtype="U"), "cases" : np.zeros(0, dtype=np.int64), "deaths" : np.zeros(0, dtype=np.int64)}
+        self.table = None
+
+        if os.path.exists(self.cache_path):
+            with np.load(self.cache_path) as data:
+                self.files = json.loads(str(data["files"]))
+                self.columns = {name : data[name] for name in self.columns}
+        self.update()
+
+    def update(self):
+        """Bring the table up to date with the directory; returns whether anything changed"""
+        changed = False
+        current = {}
+        for fname in sorted(os.listdir(self.path)):
+            if not fname.endswith(".csv"):
+                continue
+            st = os.stat(os.path.join(self.path, fname))
+            current[fname] = {"mtime_ns" : st.st_mtime_ns, "size" : st.st_size}
+
+        stale = set(self.files) - set(current)
+        for fname, info in current.items():
+            known = self.files.get(fname)
+            if known is not None and known["mtime_ns"] == info["mtime_ns"] and known["size"] == info["size"]:
+                continue
+            info["sha1"] = file_hash(os.path.join(self.path, fname))
+            if known is not None and known["sha1"] == info["sha1"]:
+                self.files[fname] = info # Touched but unchanged
+                changed = True
+                continue
+            stale.add(fname)
+            self.files[fname] = info
+        new = sorted(stale & set(current))
+
+        if stale:
+            keep = ~np.isin(self.columns["source"], list(stale))
+            parts = [{name : col[keep] for name, col in self.columns.items()}]
+            for fname in new:
+                countries, cases, deaths = read_file(os.path.join(self.path, fname))
+                parts.append({"source" : np.full(len(countries), fname), "date" : np.full(len(countries), file_date(fname)),
+                    "country" : countries, "cases" : cases, "deaths" : deaths})
+            self.columns = {name : np.concatenate([part[name] for part in parts]) for name in self.columns}
+            for fname in stale - set(current):
+                del self.files[fname]
+            changed = True
+
+        if changed:
+            self.save()
+        if changed or self.table is None:
+            self.table = self.build_table()
+        return changed
+
+    def save(self):
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, files=np.array(json.dumps(self.files)), **self.columns)
+        os.replace(tmp_path, self.cache_path)
+
+    def build_table(self):
+        cols = self.columns
+        index = pd.MultiIndex.from_arrays([pd.DatetimeIndex(cols["date"]), cols["country"]], names=["Date", "Country"])
+        return pd.DataFrame({"Cases" : cols["cases"], "Deaths" : cols["deaths"]}, index=index).sort_index()
+
+    def countries(self):
+        return sorted(self.table.index.unique("Country"))
+
+    def series(self, country):
+        """Cases and Deaths for one country, indexed by date"""
+        return self.table.xs(country, level="Country")
+
+_loaded = {} # Directory -> ActualData, so repeated queries in one process skip reading the cache
+
+def load(path=DATA_PATH):
+    """The ActualData for path, updated with any changes to the directory"""
+    if path not in _loaded:
+        _loaded[path] = ActualData(path)
+    else:
+        _loaded[path].update()
+    return _loaded[path]
+
+def read_series(path=DATA_PATH, country="Italy"):
+    """Cumulative Cases and Deaths for one country, one row per daily file, indexed by date"""
+    return load(path).series(country)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest the daily actual data files and print a country\'s series.')
+    parser.add_argument("--data", type=str, help='directory of daily actual data files', default=DATA_PATH)
+    parser.add_argument("--country", type=str, help='country to print (default: list the countries)', default=None)
+
+    args = parser.parse_args()
+    data = load(args.data)
+    if args.country is None:
+        print("\n".join(data.countries()))
+    else:
+        print(data.series(args.country).to_string())
@@ -1,44 +1,36 @@
+import argparse
 import os
-import re
-import pandas as pd
+import sys
 import matplotlib.pyplot as plt
 
-def accumulate_actual_italy(path):
-    main_df = pd.DataFrame({"Date":[], "Cases":[], "Deaths":[]})
-    for fname in os.listdir(path):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from actual import read_series
+from logger import read_log
 
-        date = re.search('2.*_0', fname)
-        date = date.group(0)[:-2]
-
-        df = pd.read_csv(os.path.join(path, fname))
-        for col in list(df):
-            if col != "Cases" and col != "Deaths":
-                country_col = col
-                break
-        df = df.loc[df[country_col] == "Italy"]
-        df = df.drop([country_col], axis=1)
-        df["Date"] = date
-        main_df = main_df.append(df)
-
-    return main_df
-
-def accumulate_simulated(path):
-    df = pd.read_csv(os.path.join(path, "log.csv"))
+def accumulate_simulated(path, scale=206, days=18):
+    df = read_log(path)
     df = df.drop([col for col in list(df) if col != "dead"], axis=1)
-    df = df.loc[df["dead"] > 0].head(18)
-    df["dead"] = df["dead"].apply(lambda x: 206*x)
+    df = df.loc[df["dead"] > 0].head(days)
+    df["dead"] = df["dead"].apply(lambda x: scale*x)
     df["Deaths"] = df["dead"]
     df = df.drop(["dead"], axis=1)
     return df
 
 if __name__ == '__main__':
-    df = accumulate_actual_italy("europe")
-    simulated = accumulate_simulated("../logs/log_20_03_2020_15_48_44")
+    parser = argparse.ArgumentParser(description='Compare simulated deaths to actual data.')
+    parser.add_argument("--dir", type=str, help='path for simulation results', default="../logs/log_20_03_2020_15_48_44")
+    parser.add_argument("--country", type=str, help='country to compare against', default="Italy")
+    parser.add_argument("--scale", type=float, help='people per simulated cell', default=206)
+    args = parser.parse_args()
+
+    df = read_series(country=args.country).reset_index()
+    simulated = accumulate_simulated(args.dir, args.scale, len(df))
 
+    df = df.head(len(simulated))
     df.index = simulated.index
     df["Simulated Deaths"] = simulated["Deaths"]
     df["Actual Deaths"] = df["Deaths"]
     df = df.drop(["Deaths", "Cases"], axis=1)
 
-    df.plot()
+    df.plot(x="Date")
     plt.show()
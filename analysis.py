@@ -0,0 +1,279 @@
+import numpy as np
+import argparse
+import csv
+import json
+import os
+from logger import COLUMNS, RECORD_DTYPE, read_counts
+
+CACHE_NAME = "analysis.cache.npz"
+CACHE_VERSION = 3
+INFECTED = COLUMNS.index("infected")
+SUSCEPTIBLE = COLUMNS.index("susceptible")
+DEAD = COLUMNS.index("dead")
+
+class RunSource(object):
+    """Logged counts found under a directory: one run's log, or the runs.npy of an ensemble
+
+    Nothing is kept open: every read opens the file for just the runs and
+    timesteps asked for.
+    """
+
+    def __init__(self, path, kind):
+        super(RunSource, self).__init__()
+        self.path = path
+        self.kind = kind
+
+    def files(self):
+        if self.kind == "ensemble":
+            return [os.path.join(self.path, "runs.npy")]
+        return [os.path.join(self.path, name) for name in ("log.bin", "log.csv") if os.path.exists(os.path.join(self.path, name))][:1]
+
+    def shape(self):
+        """(runs, timesteps)"""
+        if self.kind == "ensemble":
+            runs = np.load(os.path.join(self.path, "runs.npy"), mmap_mode="r")
+            return runs.shape[:2]
+        bin_path = os.path.join(self.path, "log.bin")
+        if os.path.exists(bin_path):
+            return 1, os.path.getsize(bin_path)//(np.dtype(RECORD_DTYPE).itemsize*len(COLUMNS))
+        with open(os.path.join(self.path, "log.csv")) as f:
+            return 1, sum(1 for line in f) - 1
+
+    def sets(self, n_runs):
+        """Parameter set of each run: the set column of an ensemble's runs.csv, 0 for a single run or without runs.csv"""
+        sets = np.zeros(n_runs, dtype=np.int64)
+        index_path = os.path.join(self.path, "runs.csv")
+        if self.kind == "ensemble" and os.path.exists(index_path):
+            with open(index_path) as f:
+                for row in csv.DictReader(f):
+                    sets[int(row["run"])] = int(row["set"])
+        return sets
+
+    def read(self, runs=slice(None), start=0, stop=None):
+        """Counts of the given runs over timesteps [start, stop), as a (runs, timesteps, 5) int64 array"""
+        if self.kind == "ensemble":
+            return np.asarray(np.load(os.path.join(self.path, "runs.npy"), mmap_mode="r")[runs, start:stop], dtype=np.int64)
+        return np.asarray(read_counts(self.path, start=start, stop=stop), dtype=np.int64)[None]
+
+def find_runs(root):
+    """RunSources for every run log and ensemble under root, found lazily while walking the tree"""
+    for path, dirs, files in os.walk(root):
+        dirs.sort()
+        if "runs.npy" in files:
+            yield RunSource(path, "ensemble")
+        elif "log.bin" in files or "log.csv" in files:
+            yield RunSource(path, "log")
+
+def manifest(sources):
+    """{file : [mtime_ns, size]} for the files behind sources, to tell whether a cache is stale"""
+    files = {}
+    for source in sources:
+        for f in source.files() + [os.path.join(source.path, "runs.csv")]:
+            if os.path.exists(f):
+                st = os.stat(f)
+                files[f] = [st.st_mtime_ns, st.st_size]
+    return files
+
+def run_stats(block):
+    """Per-run statistics of a (runs, timesteps, 5) block of counts"""
+    block = np.asarray(block, dtype=np.int64)
+    totals = block.sum(axis=2)
+    infected = block[:, :, INFECTED]
+    return {"population" : totals[:, 0], "conserved" : (totals == totals[:, :1]).all(axis=1),
+        "length" : np.full(len(block), block.shape[1]), "peak_infected" : infected.max(axis=1), "peak_step" : infected.argmax(axis=1) + 1,
+        "final" : block[:, -1, :]}
+
+class Analysis(object):
+    """Cross-run statistics of every run under a directory tree
+
+    Runs are pooled into cohorts of comparable runs: each parameter set of an
+    ensemble, and the single-run logs in one directory with the same
+    population. Quantile bands and summaries are computed per cohort.
+
+    Sources are read one at a time, in chunks of about memory_limit bytes:
+    per-run statistics (conservation, peak timing, final counts) a few runs at
+    a time, and each cohort's per-timestep means and quantile bands a range of
+    timesteps at a time, so memory stays bounded however many runs there are.
+    Runs that stopped early count only for the timesteps they reached; logs
+    with no complete step (e.g. of runs killed before their first write) are
+    skipped and listed in the summary. Results are cached in the directory and
+    reused while no log has changed.
+    """
+
+    def __init__(self, root, quantiles=(0.05, 0.5, 0.95), memory_limit=64*2**20, use_cache=True):
+        super(Analysis, self).__init__()
+        self.root = root
+        self.quantiles = np.asarray(quantiles, dtype=float)
+        self.memory_limit = memory_limit
+        self.cache_path = os.path.join(root, CACHE_NAME)
+
+        self.sources = list(find_runs(root))
+        if not self.sources:
+            raise ValueError("No run logs found under " + root)
+        self.files = manifest(self.sources)
+        if not (use_cache and self.load_cache()):
+            self.compute()
+            self.save_cache()
+
+    def load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return False
+        with np.load(self.cache_path) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("version") != CACHE_VERSION or meta["files"] != self.files or meta["quantiles"] != self.quantiles.tolist():
+                return False
+            self.__dict__.update({name : data[name] for name in data.files if name != "meta"})
+        return True
+
+    def save_cache(self):
+        meta = {"version" : CACHE_VERSION, "files" : self.files, "quantiles" : self.quantiles.tolist()}
+        arrays = {name : getattr(self, name) for name in ("names", "skipped", "run_index", "run_in_source", "cohorts", "run_cohort", "mean", "bands",
+            "n_runs", "population", "conserved", "length", "peak_infected", "peak_step", "final")}
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp_path, self.cache_path)
+
+    def compute(self):
+        row_bytes = 8*len(COLUMNS)
+        shapes = [source.shape() for source in self.sources]
+        usable = [(source, shape) for source, shape in zip(self.sources, shapes) if min(shape) > 0]
+        sources = [source for source, _ in usable]
+        self.skipped = np.array([os.path.relpath(source.path, self.root) for source, shape in zip(self.sources, shapes) if min(shape) == 0], dtype=str)
+        if not sources:
+            raise ValueError("Only empty run logs found under " + self.root)
+
+        # Per-run statistics, one source and a bounded number of runs at a time
+        stats = []
+        run_index = []
+        run_in_source = []
+        cohort_keys = []
+        for k, (source, (runs, timesteps)) in enumerate(usable):
+            step = max(1, self.memory_limit//(row_bytes*max(timesteps, 1)))
+            for i in range(0, runs, step):
+                stats.append(run_stats(source.read(slice(i, i + step))))
+            name = os.path.relpath(source.path, self.root)
+            if source.kind == "ensemble":
+                cohort_keys += [f"{name} set {s}" for s in source.sets(runs)]
+            else:
+                cohort_keys.append((os.path.dirname(name) or ".", int(stats[-1]["population"][0])))
+            run_index.append(np.full(runs, k))
+            run_in_source.append(np.arange(runs))
+        for name in stats[0]:
+            setattr(self, name, np.concatenate([s[name] for s in stats]))
+        self.names = np.array([os.path.relpath(source.path, self.root) for source in sources])
+        self.run_index = np.concatenate(run_index) # Source of each run
+        self.run_in_source = np.concatenate(run_in_source) # Its row within the source
+
+        # Single-run logs are pooled by directory and population
+        keys = [key if isinstance(key, str) else f"{key[0]} logs, {key[1]} cells" for key in cohort_keys]
+        self.cohorts, self.run_cohort = np.unique(np.array(keys), return_inverse=True)
+
+        # Means and quantile bands of each cohort over every run present at each timestep, a bounded number of timesteps at a time
+        timesteps = int(self.length.max())
+        self.mean = np.full((len(self.cohorts), timesteps, len(COLUMNS)), np.nan)
+        self.bands = np.full((len(self.cohorts), len(self.quantiles), timesteps, len(COLUMNS)), np.nan)
+        self.n_runs = np.zeros((len(self.cohorts), timesteps), dtype=np.int64)
+        for c in range(len(self.cohorts)):
+            members = np.flatnonzero(self.run_cohort == c)
+            length = int(self.length[members].max())
+            chunk = max(1, self.memory_limit//(row_bytes*len(members)))
+            for t0 in range(0, length, chunk):
+                t1 = min(t0 + chunk, length)
+                block = np.full((len(members), t1 - t0, len(COLUMNS)), np.nan)
+                for k in np.unique(self.run_index[members]):
+                    rows = np.flatnonzero(self.run_index[members] == k)
+                    part = sources[k].read(self.run_in_source[members[rows]], t0, t1)
+                    block[rows, :part.shape[1]] = part
+                present = ~np.isnan(block[:, :, 0])
+                self.n_runs[c, t0:t1] = present.sum(axis=0)
+                if present.all():
+                    self.mean[c, t0:t1] = block.mean(axis=0)
+                    self.bands[c, :, t0:t1] = np.quantile(block, self.quantiles, axis=0)
+                else:
+                    self.mean[c, t0:t1] = np.nanmean(block, axis=0)
+                    self.bands[c, :, t0:t1] = np.nanquantile(block, self.quantiles, axis=0)
+
+    @property
+    def final_size(self):
+        """Cells that were ever infected, by the end of each run, assuming none was reinfected: population minus final susceptible"""
+        return self.population - self.final[:, SUSCEPTIBLE]
+
+    def unconserved(self):
+        """Names of the sources with at least one run whose total count changed"""
+        return sorted(set(self.names[self.run_index[~self.conserved]]))
+
+    def summary(self):
+        q = lambda x: dict(zip([f"q{qt:g}" for qt in self.quantiles], np.quantile(x, self.quantiles).tolist()))
+        cohorts = {}
+        for c, name in enumerate(self.cohorts):
+            members = self.run_cohort == c
+            cohorts[str(name)] = {"runs" : int(members.sum()), "timesteps" : int(self.length[members].max()),
+                "population" : q(self.population[members]), "peak_infected" : q(self.peak_infected[members]),
+                "peak_step" : q(self.peak_step[members]), "final_size" : q(self.final_size[members]), "final_dead" : q(self.final[members, DEAD])}
+        return {"sources" : len(self.names), "runs" : len(self.run_index), "unconserved" : self.unconserved(), "skipped" : self.skipped.tolist(),
+            "cohorts" : cohorts}
+
+    def plot(self, out_path=None):
+        """Plot each cohort's bands, and the peak timing and final sizes; saved as PNGs in out_path, or shown if out_path is None"""
+        import matplotlib
+        if out_path is not None:
+            matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+        n = len(self.cohorts)
+        ncols = min(n, 3)
+        nrows = (n + ncols - 1)//ncols
+        fig, axes = plt.subplots(nrows, ncols, figsize=(6*ncols, 4*nrows), squeeze=False)
+        middle = int(np.argmin(np.abs(self.quantiles - 0.5)))
+        for c, ax in enumerate(axes.ravel()):
+            if c >= n:
+                ax.set_visible(False)
+                continue
+            steps = np.arange(1, self.bands.shape[2] + 1)
+            for s, column in enumerate(COLUMNS):
+                line, = ax.plot(steps, self.bands[c, middle, :, s], label=column)
+                ax.fill_between(steps, self.bands[c, 0, :, s], self.bands[c, -1, :, s], color=line.get_color(), alpha=0.2)
+            ax.set_xlabel("timestep")
+            ax.set_ylabel("cells")
+            ax.set_title(f"{self.cohorts[c]}: {np.count_nonzero(self.run_cohort == c)} runs", fontsize=9)
+        axes[0, 0].legend()
+        fig.suptitle(f"q{self.quantiles[middle]:g} with q{self.quantiles[0]:g}-q{self.quantiles[-1]:g} bands")
+        fig.tight_layout()
+
+        fig2, (ax_peak, ax_final) = plt.subplots(1, 2, figsize=(12, 4.5))
+        for c, name in enumerate(self.cohorts):
+            members = self.run_cohort == c
+            ax_peak.hist(self.peak_step[members], bins=min(50, max(np.count_nonzero(members)//5, 1)), alpha=0.5, label=name)
+            ax_final.hist(self.final_size[members], bins=min(50, max(np.count_nonzero(members)//5, 1)), alpha=0.5, label=name)
+        ax_peak.set_xlabel("timestep of peak infected")
+        ax_peak.set_ylabel("runs")
+        ax_final.set_xlabel("final size (population - final susceptible)")
+        ax_final.legend(fontsize=8)
+
+        if out_path is None:
+            plt.show()
+            return
+        os.makedirs(out_path, exist_ok=True)
+        fig.savefig(os.path.join(out_path, "bands.png"), dpi=120)
+        fig2.savefig(os.path.join(out_path, "distributions.png"), dpi=120)
+        plt.close(fig)
+        plt.close(fig2)
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize and plot every simulation run or ensemble under a directory.')
+    parser.add_argument("--dir", type=str, help='directory to search for run logs (log.bin/log.csv) and ensembles (runs.npy)')
+    parser.add_argument("--out", type=str, help='directory to save plots to (default: show them)', default=None)
+    parser.add_argument("--quantiles", nargs='+', type=float, help='quantiles of the bands; the outer two are shaded', default=[0.05, 0.5, 0.95])
+    parser.add_argument("--memory", type=float, help='approximate memory limit in MB for reading runs', default=64)
+    parser.add_argument("--no_cache", help='recompute even if a cached analysis is up to date', default=False, action="store_true")
+    parser.add_argument("--no_plot", help='only print the summary', default=False, action="store_true")
+
+    args = parser.parse_args()
+    analysis = Analysis(args.dir, args.quantiles, int(args.memory*2**20), not args.no_cache)
+    print(json.dumps(analysis.summary(), indent=4))
+    if not args.no_plot:
+        analysis.plot(args.out)
+
+if __name__ == '__main__':
+    main()
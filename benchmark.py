@@ -0,0 +1,144 @@
+import numpy as np
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from engine import INFECTED
+from simulation import SIM_ENGINES, Simulation
+from timing import NULL_TIMER
+
+CASE_KEYS = ["engine", "size", "density", "movement_prob"]
+
+def seed_density(sim, density):
+    """Infect a fraction density of the cells, with infection counters spread over the infectious period"""
+    rng = sim.streams["init"]
+    infected = rng.random(sim.grid_shape) < density
+    sim.engine.state[infected] = INFECTED
+    sim.engine.time_counter[infected] = rng.integers(sim.max_infected + 1, size=int(infected.sum()))
+    sim.engine.refresh()
+    sim.counts = sim.engine.counts()
+
+def make_renderer(shape):
+    """A GridRenderer drawing into a hidden window, or (None, None) if no display is available"""
+    try:
+        import pyglet
+        from renderer import GridRenderer
+        window = pyglet.window.Window(shape[1], shape[0], visible=False)
+    except Exception:
+        return None, None
+    return window, GridRenderer(shape, 1)
+
+def run_case(engine, size, density, movement_prob, steps, warmup, log_format, render, seed):
+    """Time one configuration on a size x size grid
+
+    Runs warmup untimed steps, then times steps steps phase by phase. Each case
+    runs in a fresh process, so the peak resident memory reported is its own.
+    peak_rss_mb covers that process only; worker processes (the sharded
+    engine's) are reported separately as the largest peak of any one worker,
+    since they map the same shared grid and their sum would count it repeatedly.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        sim = Simulation(os.path.join(tmp, "log"), warmup + steps, cell_size=1, width=size, height=size, engine=engine,
+            log_format=log_format, seed=seed)
+        params = sim.get_params()
+        params["movement_prob"] = movement_prob
+        sim.set_params_from_config(params)
+        seed_density(sim, density)
+
+        window, renderer = make_renderer(sim.grid_shape) if render else (None, None)
+        for i in range(warmup):
+            sim.step()
+
+        sim.profile()
+        start = time.perf_counter()
+        for i in range(steps):
+            sim.step()
+            if renderer is not None:
+                renderer.update(sim.engine.state)
+                renderer.draw()
+                sim.timer.lap("rendering")
+        seconds = time.perf_counter() - start
+
+        phases = {phase : 1000*stats["mean"] for phase, stats in sim.timer.report().items()}
+        n_workers = sim.engine.n_shards if engine == "sharded" else 0
+        sim.timer = NULL_TIMER
+        sim.close() # Joins any workers, so their usage shows up under RUSAGE_CHILDREN
+        if renderer is not None:
+            renderer.delete()
+            window.close()
+
+    return {"engine" : engine, "size" : size, "density" : density, "movement_prob" : movement_prob, "steps" : steps,
+        "seconds" : seconds, "steps_per_sec" : steps/seconds, "cells_per_sec" : size*size*steps/seconds,
+        "peak_rss_mb" : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024, "workers" : n_workers,
+        "peak_worker_rss_mb" : resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss/1024 if n_workers else 0.0,
+        "phase_ms" : phases, "rendered" : renderer is not None}
+
+def environment():
+    """Versions and machine the results were measured on, so result files can be compared across commits"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"commit" : commit, "date" : datetime.now().isoformat(timespec="seconds"), "python" : platform.python_version(),
+        "numpy" : np.__version__, "machine" : platform.machine(), "processor" : platform.processor(), "cpus" : os.cpu_count()}
+
+def case_key(result):
+    return tuple(result[k] for k in CASE_KEYS)
+
+def compare(results, baseline_path):
+    """Print the change in steps/sec against the matching cases of an earlier results file"""
+    with open(baseline_path) as f:
+        baseline = {case_key(r) : r for r in json.load(f)["results"]}
+    print(f"Against {baseline_path}:")
+    for result in results:
+        old = baseline.get(case_key(result))
+        if old is not None:
+            print(f"{str(case_key(result)):<40}{result['steps_per_sec']/old['steps_per_sec'] - 1:>+8.1%}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark simulation throughput across grid sizes, infection densities and movement probabilities.')
+    parser.add_argument("--sizes", nargs='+', type=int, help='grid side lengths in cells', default=[32, 100, 316, 1000])
+    parser.add_argument("--densities", nargs='+', type=float, help='fractions of cells infected at the start', default=[0.001, 0.1])
+    parser.add_argument("--movement_probs", nargs='+', type=float, help='movement probabilities', default=[0.0, 0.05])
+    parser.add_argument("--engines", nargs='+', help='engines to benchmark', choices=list(SIM_ENGINES), default=["grid", "frontier", "calendar"])
+    parser.add_argument("--steps", type=int, help='timed steps per case', default=20)
+    parser.add_argument("--warmup", type=int, help='untimed steps before timing each case', default=2)
+    parser.add_argument("--log_format", type=str, help='logger used while benchmarking', choices=["binary", "csv"], default="binary")
+    parser.add_argument("--render", help='also time rendering each step (needs a display)', default=False, action="store_true")
+    parser.add_argument("--seed", type=int, help='random seed', default=0)
+    parser.add_argument("--out", type=str, help='JSON file to write results to', default=os.path.join("benchmarks", datetime.now().strftime("bench_%d_%m_%Y_%H_%M_%S.json")))
+    parser.add_argument("--compare", type=str, help='earlier results file to compare steps/sec against', default=None)
+
+    args = parser.parse_args()
+    cases = list(itertools.product(args.engines, args.sizes, args.densities, args.movement_probs))
+
+    results = []
+    print(f"{'engine':<10}{'size':>6}{'density':>9}{'move':>6}{'steps/s':>10}{'Mcells/s':>10}{'main MB':>9}{'worker MB':>11}  phases (ms)")
+    # One process per case, run one at a time so cases do not compete for cores or share peak memory
+    with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as executor:
+        for engine, size, density, movement_prob in cases:
+            r = executor.submit(run_case, engine, size, density, movement_prob, args.steps, args.warmup, args.log_format, args.render, args.seed).result()
+            results.append(r)
+            phases = " ".join([f"{phase}={ms:.2f}" for phase, ms in r["phase_ms"].items()])
+            print(f"{engine:<10}{size:>6}{density:>9g}{movement_prob:>6g}{r['steps_per_sec']:>10.1f}{r['cells_per_sec']/1e6:>10.2f}{r['peak_rss_mb']:>9.0f}{r['peak_worker_rss_mb']:>11.0f}  {phases}")
+
+    if args.render and not all([r["rendered"] for r in results]):
+        print("No display available, so rendering was not timed")
+    if os.path.dirname(args.out):
+        os.makedirs(os.path.dirname(args.out), exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump({"environment" : environment(), "args" : vars(args), "results" : results}, f, indent=4)
+    print("Saved results to: " + args.out)
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+import numpy as np
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from actual import DATA_PATH, read_series
+from ensemble import apply_overrides, member_seed
+from logger import COLUMNS
+from simulation import Simulation
+
+DEAD = COLUMNS.index("dead")
+ACTIVE = [COLUMNS.index("latent"), COLUMNS.index("infected")]
+DEFAULT_BOUNDS = ["max_latent=2:10", "max_infected=10:30", "prob_death=0.0001:0.01", "movement_prob=0.0:0.2", "a=0.5:3.0", "b=0.5:3.0"]
+
+def parse_bounds(specs):
+    """Turn ["max_latent=2:10", "prob_death=0.0001:0.01"] into {name : (low, high)}; integer bounds search integers"""
+    bounds = {}
+    for spec in specs:
+        name, vals = spec.split("=")
+        low, high = [float(v) if "." in v or "e" in v else int(v) for v in vals.split(":")]
+        bounds[name] = (low, high)
+    return bounds
+
+def sample_points(bounds, n, rng):
+    """n points drawn uniformly from bounds"""
+    points = []
+    for i in range(n):
+        point = {}
+        for name, (low, high) in bounds.items():
+            if isinstance(low, int) and isinstance(high, int):
+                point[name] = int(rng.integers(low, high + 1))
+            else:
+                point[name] = float(rng.uniform(low, high))
+        points.append(point)
+    return points
+
+def refine_bounds(bounds, point, fraction):
+    """Bounds fraction as wide as bounds, centred on point and clipped to bounds"""
+    refined = {}
+    for name, (low, high) in bounds.items():
+        half = fraction*(high - low)/2
+        new_low, new_high = max(low, point[name] - half), min(high, point[name] + half)
+        if isinstance(low, int) and isinstance(high, int):
+            new_low, new_high = int(np.floor(new_low)), int(np.ceil(new_high))
+        refined[name] = (new_low, new_high)
+    return refined
+
+def point_key(point):
+    return ";".join([name + "=" + repr(point[name]) for name in sorted(point)])
+
+def aligned_error(dead, observed, scale):
+    """Squared log errors between observed deaths and scale*dead, from the first step simulated deaths reach observed[0]
+
+    Returns an empty array if they never do. The result is shorter than
+    observed while the simulation has not run far enough past that step.
+    """
+    simulated = scale*dead
+    reached = np.flatnonzero(simulated >= observed[0])
+    if len(reached) == 0:
+        return np.zeros(0)
+    window = simulated[reached[0]:reached[0] + len(observed)]
+    return (np.log1p(window) - np.log1p(observed[:len(window)]))**2
+
+def evaluate(init_config, point, observed, scale, n_runs, timesteps, base_seed, reject_above=np.inf, chunk=10):
+    """Loss of one parameter point: aligned squared log error of the replicate-mean deaths
+
+    The n_runs replicates advance together in one batched engine, chunk steps at
+    a time. The run stops as soon as the whole observed window has been
+    compared or the epidemic has died out, and is rejected early once the
+    partial loss (a lower bound on the final one) exceeds reject_above. A run
+    cut off by timesteps before covering the window has infinite loss.
+    Returns a dict with the loss, the steps run and whether it was rejected.
+    """
+    sim = Simulation(run_time=timesteps, load_path=init_config, seed=member_seed(base_seed, 0))
+    apply_overrides(sim, point)
+
+    engine = sim.make_batch_engine([member_seed(base_seed, j) for j in range(n_runs)])
+
+    dead = np.zeros(0)
+    steps = 0
+    extinct = False
+    while steps < timesteps:
+        counts = engine.run(min(chunk, timesteps - steps))
+        steps += counts.shape[1]
+        dead = np.concatenate([dead, counts[:, :, DEAD].mean(axis=0)])
+
+        error = aligned_error(dead, observed, scale)
+        if error.sum() > reject_above:
+            return {"loss" : float(error.sum()), "steps" : steps, "rejected" : True}
+        extinct = counts[:, -1, ACTIVE].sum() == 0
+        if len(error) == len(observed) or extinct:
+            break
+
+    error = aligned_error(dead, observed, scale)
+    if len(error) == 0 or (len(error) < len(observed) and not extinct):
+        return {"loss" : float("inf"), "steps" : steps, "rejected" : False}
+    # Deaths no longer change once the epidemic has died out, so pad with the last value
+    padded = np.concatenate([dead, np.full(len(observed), dead[-1])])
+    return {"loss" : float(aligned_error(padded, observed, scale).sum()), "steps" : steps, "rejected" : False}
+
+class EvaluationCache(object):
+    """Completed evaluations, appended to evaluations.csv as they finish so an interrupted search can resume
+
+    The first line records the settings the losses were computed with, and
+    resuming with different settings raises ValueError rather than mixing
+    incomparable losses.
+    """
+
+    def __init__(self, path, settings):
+        super(EvaluationCache, self).__init__()
+        self.path = os.path.join(path, "evaluations.csv")
+        self.results = {}
+        header = "# " + json.dumps(settings, sort_keys=True) + "\n"
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                if f.readline() != header:
+                    raise ValueError(f"{self.path} was computed with different settings; use another --out_path")
+                f.readline()
+                for line in f:
+                    key, loss, steps, rejected = line.strip().split(",")
+                    self.results[key] = {"loss" : float(loss), "steps" : int(steps), "rejected" : rejected == "True"}
+            self.f = open(self.path, "a")
+        else:
+            self.f = open(self.path, "w")
+            self.f.write(header + "params,loss,steps,rejected\n")
+
+    def __contains__(self, point):
+        return point_key(point) in self.results
+
+    def add(self, point, result):
+        key = point_key(point)
+        self.results[key] = result
+        self.f.write(",".join([key, repr(result["loss"]), str(result["steps"]), str(result["rejected"])]) + "\n")
+        self.f.flush()
+
+    def loss(self, point):
+        return self.results[point_key(point)]["loss"]
+
+    def close(self):
+        self.f.close()
+
+def calibrate(out_path, init_config, observed, scale, bounds, n_points=64, rounds=3, keep=4, shrink=0.5, n_runs=8, timesteps=200,
+        seed=0, reject_factor=2.0, max_workers=None):
+    """Coarse-to-fine search for the parameters whose simulated deaths best match observed
+
+    Each round samples n_points, split evenly between the current regions; the
+    first region is the full bounds, and each later round searches regions
+    shrink times narrower around the keep best points found so far. Points are
+    evaluated in parallel, and a point is abandoned once its partial loss
+    exceeds reject_factor times the keep-th best loss so far. Sampling depends
+    only on seed and on the cached losses, so rerunning an interrupted search
+    with the same arguments reuses every finished evaluation.
+    """
+    os.makedirs(out_path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    settings = {"init_config" : init_config, "observed" : hashlib.sha1(np.asarray(observed, dtype=float).tobytes()).hexdigest(),
+        "scale" : float(scale), "runs" : n_runs, "timesteps" : timesteps, "seed" : seed}
+    cache = EvaluationCache(out_path, settings)
+    in_flight = 2*(max_workers or os.cpu_count() or 1)
+
+    evaluated = []
+    regions = [bounds]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for r in range(rounds):
+            points = []
+            for region in regions:
+                points += sample_points(region, n_points//len(regions), rng)
+            evaluated += points
+
+            pending = {}
+            todo = [p for p in points if p not in cache]
+            while todo or pending:
+                while todo and len(pending) < in_flight:
+                    losses = sorted([cache.loss(p) for p in evaluated if p in cache])
+                    reject_above = reject_factor*losses[keep - 1] if len(losses) >= keep else np.inf
+                    point = todo.pop(0)
+                    future = executor.submit(evaluate, init_config, point, observed, scale, n_runs, timesteps, seed, reject_above)
+                    pending[future] = point
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    cache.add(pending.pop(future), future.result())
+
+            best = sorted(evaluated, key=cache.loss)[:keep]
+            print(f"Round {r + 1}/{rounds}: best loss {cache.loss(best[0]):.4f} with {point_key(best[0])}")
+            regions = [refine_bounds(bounds, p, shrink**(r + 1)) for p in best]
+
+    cache.close()
+    best = min(evaluated, key=cache.loss)
+    with open(os.path.join(out_path, "best.json"), "w") as f:
+        json.dump({"params" : best, "loss" : cache.loss(best)}, f, indent=4)
+    return best, cache.loss(best)
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit simulation parameters to actual death counts.')
+    parser.add_argument("--out_path", type=str, help='path to save evaluations and the best parameters', default=os.path.join("calibrations", datetime.now().strftime("calibration_%d_%m_%Y_%H_%M_%S")))
+    parser.add_argument("--init_config", type=str, help='path to init config file', default="")
+    parser.add_argument("--data", type=str, help='directory of daily actual data files', default=DATA_PATH)
+    parser.add_argument("--country", type=str, help='country to fit', default="Italy")
+    parser.add_argument("--population", type=float, help='population of the country; each cell stands for population/cells people', default=60.36e6)
+    parser.add_argument("--bounds", nargs='+', help='search bounds, e.g. max_latent=2:10 prob_death=0.0001:0.01', default=DEFAULT_BOUNDS)
+    parser.add_argument("--points", type=int, help='parameter points evaluated per round', default=64)
+    parser.add_argument("--rounds", type=int, help='coarse-to-fine rounds', default=3)
+    parser.add_argument("--keep", type=int, help='best points refined around in the next round', default=4)
+    parser.add_argument("--shrink", type=float, help='factor by which search regions narrow each round', default=0.5)
+    parser.add_argument("--runs", type=int, help='replicates per parameter point', default=8)
+    parser.add_argument("--timesteps", type=int, help='maximum timesteps per simulation', default=200)
+    parser.add_argument("--seed", type=int, help='seed for sampling points and replicates', default=0)
+    parser.add_argument("--reject_factor", type=float, help='abandon points whose partial loss exceeds this times the keep-th best loss', default=2.0)
+    parser.add_argument("--workers", type=int, help='number of worker processes (default: all cores)', default=None)
+
+    args = parser.parse_args()
+    print("Saving to: " + args.out_path)
+
+    deaths = read_series(args.data, args.country)["Deaths"].to_numpy()
+    observed = deaths[np.argmax(deaths > 0):].astype(float)
+    rows, cols = Simulation(load_path=args.init_config).grid_shape
+    scale = args.population/(rows*cols)
+
+    try:
+        best, loss = calibrate(args.out_path, args.init_config, observed, scale, parse_bounds(args.bounds), args.points, args.rounds,
+            args.keep, args.shrink, args.runs, args.timesteps, args.seed, args.reject_factor, args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Best loss {loss:.4f}: " + point_key(best))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import numpy as np
+import json
+import os
+
+CHECKPOINT_ARRAYS = ["state", "time_counter", "resistance"] # Engine arrays; movement has already permuted them in place
+ATTRIBUTE_PREFIX = "attribute_" # Engine attributes are saved as attribute_<name>
+
+class Checkpointer(object):
+    """Save and restore the full state of a running simulation."""
+
+    def __init__(self, sim):
+        super(Checkpointer, self).__init__()
+        self.sim = sim
+
+    def save(self, path):
+        """Write a checkpoint to path (an .npz file), replacing any previous one atomically"""
+        sim = self.sim
+        if sim.logger is not None:
+            sim.logger.flush()
+            sim.group_logger.flush()
+        if sim.recorder is not None:
+            sim.recorder.flush()
+
+        meta = {
+            "config" : sim.get_config_no_grid(),
+            "engine_mode" : sim.engine_mode,
+            "run_time" : sim.run_time,
+            "timestep" : sim.timestep,
+            "log_format" : sim.log_format,
+            "log_steps" : sim.logger.steps if sim.logger is not None else 0,
+            "record_settings" : sim.record_settings,
+            "streams" : {name : rng.bit_generator.state for name, rng in sim.streams.items()},
+            "shards" : sim.engine.n_shards if sim.engine_mode == "sharded" else None,
+            "shard_streams" : sim.engine.stream_states() if sim.engine_mode == "sharded" else None,
+            "stats" : sim.stats.state(),
+        }
+        arrays = {name : getattr(sim.engine, name) for name in CHECKPOINT_ARRAYS}
+        arrays.update({ATTRIBUTE_PREFIX + name : arr for name, arr in sim.engine.attributes.items()})
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Restore the grid, parameters and counters from path; returns the checkpoint metadata
+
+        The random streams are not restored here, since rebuilding the rest of the
+        simulation may still draw numbers; call restore_streams last.
+        """
+        sim = self.sim
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            config = meta["config"]
+            sim.engine_mode = meta["engine_mode"]
+            if meta.get("shards") is not None:
+                sim.shards = meta["shards"] # The bands, and so the run, depend on the number of shards
+            sim.set_params_from_config(config["params"])
+            sim.set_props_from_config(config["props"])
+            sim.set_settings_from_config(config["settings"])
+            if "contact" in config:
+                sim.set_contact_from_config(config["contact"])
+            sim.init_cells({name[len(ATTRIBUTE_PREFIX):] : data[name] for name in data.files if name.startswith(ATTRIBUTE_PREFIX)})
+            for name in CHECKPOINT_ARRAYS:
+                getattr(sim.engine, name)[...] = data[name]
+
+        sim.run_time = meta["run_time"]
+        sim.timestep = meta["timestep"]
+        self.meta = meta
+        return meta
+
+    def restore_streams(self):
+        for name, state in self.meta["streams"].items():
+            self.sim.streams[name].bit_generator.state = state
+        if self.meta.get("shard_streams") is not None:
+            self.sim.engine.set_stream_states(self.meta["shard_streams"])
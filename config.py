@@ -1,7 +1,10 @@
+import numpy as np
 import ruamel.yaml
 import os
 from datetime import datetime
 
+GRID_ARRAYS = ["state", "time_counter", "resistance"] # Engine arrays saved alongside the YAML header
+
 class ConfigLogger(object):
     """Save and load configurations for simulation."""
 
@@ -14,37 +17,61 @@ class ConfigLogger(object):
         self.sim = sim
 
     def save_curr_config(self, path):
-        states_list = []
-        for row in range(len(self.sim.cell_list)):
-            states_list.append([cell.state for cell in self.sim.cell_list[row]])
+        """Save params/props/settings to the YAML file at path and the grid as .npy files beside it"""
+        dirname = os.path.dirname(path)
+        os.makedirs(dirname, exist_ok=True)
+
+        to_dump = self.sim.get_config_no_grid()
+        to_dump["grid_files"] = {}
+        to_dump["attribute_files"] = {}
+        engine = self.sim.engine
+        for name in GRID_ARRAYS:
+            fname = name + ".npy"
+            np.save(os.path.join(dirname, fname), getattr(engine, name))
+            to_dump["grid_files"][name] = fname
+        for name, arr in engine.attributes.items():
+            fname = "attribute_" + name + ".npy"
+            np.save(os.path.join(dirname, fname), arr)
+            to_dump["attribute_files"][name] = fname
 
-        os.makedirs(os.path.dirname(path), exist_ok=True)
         with open(path, 'w') as f:
-            to_dump = self.sim.get_config_no_grid()
-            to_dump["grid"] = states_list
-            data = self.yaml.dump(to_dump, f)
+            self.yaml.dump(to_dump, f)
 
     def load_config(self, path):
-        f = open(path, 'r')
-        data = self.yaml.load(f)
+        """Load a config saved by save_curr_config, or an older one with the grid inlined as YAML lists"""
+        with open(path, 'r') as f:
+            data = self.yaml.load(f)
 
         self.sim.set_params_from_config(data['params'])
         self.sim.set_props_from_config(data['props'])
         self.sim.set_settings_from_config(data['settings'])
-        self.sim.init_cells()
+        if "contact" in data:
+            self.sim.set_contact_from_config(data["contact"])
+        attributes = {}
+        for name, fname in data.get("attribute_files", {}).items():
+            arr = np.load(os.path.join(os.path.dirname(path), fname), mmap_mode='r')
+            attributes[name] = np.zeros(self.sim.grid_shape, dtype=arr.dtype)
+            copy_clipped(attributes[name], arr)
+        self.sim.init_cells(attributes)
 
-        grid = data["grid"]
+        engine = self.sim.engine
+        if "grid_files" in data:
+            for name, fname in data["grid_files"].items():
+                arr = np.load(os.path.join(os.path.dirname(path), fname), mmap_mode='r')
+                copy_clipped(getattr(engine, name), arr)
+        else:
+            # Older configs only stored states; resistances keep the values drawn by init_cells
+            copy_clipped(engine.state, np.array(data["grid"], dtype=np.uint8))
 
-        for row in range(len(self.sim.cell_list)):
-            for col in range(len(self.sim.cell_list[row])):
-                try:
-                    self.sim.cell_list[row][col].state = grid[row][col]
-                except:
-                    print(str(row) + ", " + str(col))
+def copy_clipped(dst, src):
+    """Copy the overlapping top-left block of src into dst"""
+    rows = min(dst.shape[0], src.shape[0])
+    cols = min(dst.shape[1], src.shape[1])
+    dst[:rows, :cols] = src[:rows, :cols]
 
 if __name__ == '__main__':
-    from main import SimulationWindow
-    window = SimulationWindow(os.path.join("logs", datetime.now().strftime("%d_%m_%Y_%H_%M_%S")), 1500)
-    c = ConfigLogger(window)
+    from simulation import Simulation
+    sim = Simulation(os.path.join("logs", datetime.now().strftime("%d_%m_%Y_%H_%M_%S")), 1500)
+    c = ConfigLogger(sim)
     c.save_curr_config("configs/example_config.yml")
     c.load_config("configs/example_config.yml")
@@ -0,0 +1,198 @@
+import numpy as np
+import os
+
+class Stencil(object):
+    """Contacts at fixed (row, col) offsets from every cell, with a weight per offset
+
+    A cell's infection pressure is the sum over its infected contacts of
+    weight*sqrt(u), with u a fresh uniform draw per contact. Cells past the
+    edge of the grid are never infected, unless periodic, in which case the
+    grid wraps around.
+    """
+
+    def __init__(self, offsets, weights, periodic=False):
+        super(Stencil, self).__init__()
+        self.offsets = [(int(dr), int(dc)) for dr, dc in offsets]
+        self.weights = np.asarray(weights, dtype=float)
+        self.radius = max([max(abs(dr), abs(dc)) for dr, dc in self.offsets] + [0])
+        self.periodic = periodic
+
+    @classmethod
+    def from_kernel(cls, kernel, periodic=False):
+        """Stencil from a (2r + 1, 2r + 1) weight array centred on the cell; zero weights are not contacts
+
+        Row 0 of the kernel holds the offsets furthest above the cell
+        (largest row offset), matching how the grid is drawn.
+        """
+        kernel = np.asarray(kernel, dtype=float)
+        r = kernel.shape[0]//2
+        rows, cols = np.nonzero(kernel)
+        keep = (rows != r) | (cols != r)
+        offsets = list(zip(r - rows[keep], cols[keep] - r))
+        return cls(offsets, kernel[rows[keep], cols[keep]], periodic)
+
+    def kernel(self):
+        r = self.radius
+        kernel = np.zeros((2*r + 1, 2*r + 1))
+        for (dr, dc), w in zip(self.offsets, self.weights):
+            kernel[r - dr, r + dc] = w
+        return kernel
+
+    def pad(self, mask, rows=True):
+        """mask with a border of radius cells (wrapped if periodic); rows=False pads the columns only"""
+        r = self.radius
+        widths = [(0, 0)]*(mask.ndim - 2) + [(r, r) if rows else (0, 0), (r, r)]
+        return np.pad(mask, widths, mode="wrap" if self.periodic else "constant")
+
+    def exposed(self, infected_padded, shape):
+        """Cells with at least one infected contact: the infected mask convolved with the stencil's footprint"""
+        rows, cols = shape[-2:]
+        r = self.radius
+        exposed = np.zeros(shape, dtype=bool)
+        for dr, dc in self.offsets:
+            exposed |= infected_padded[..., r + dr:r + dr + rows, r + dc:r + dc + cols]
+        return exposed
+
+    def pressure(self, engine, idx, infected_padded):
+        """Infection pressure for the cells in idx (an np.nonzero tuple), one draw per (cell, offset)"""
+        prefix, rows, cols = idx[:-2], idx[-2], idx[-1]
+        r = self.radius
+        u = engine.uniform(idx, "infection", k=len(self.offsets))
+        total = np.zeros(len(rows))
+        for k, (dr, dc) in enumerate(self.offsets):
+            total += self.weights[k]*(infected_padded[prefix + (rows + r + dr, cols + r + dc)]*np.sqrt(u[k]))
+        return total
+
+    def edges(self, idx, shape):
+        """(owner, cells, weights): each cell that has the cell at flat index idx[owner] as a contact"""
+        rows, cols = shape
+        r, c = np.divmod(idx, cols)
+        owners = []
+        cells = []
+        weights = []
+        for (dr, dc), w in zip(self.offsets, self.weights):
+            # The cell at (r - dr, c - dc) sees (r, c) at offset (dr, dc)
+            nr, nc = r - dr, c - dc
+            if self.periodic:
+                owner = np.arange(len(idx))
+                nr, nc = nr % rows, nc % cols
+            else:
+                owner = np.flatnonzero((nr >= 0) & (nr < rows) & (nc >= 0) & (nc < cols))
+                nr, nc = nr[owner], nc[owner]
+            owners.append(owner)
+            cells.append(nr*cols + nc)
+            weights.append(np.full(len(owner), w))
+        return np.concatenate(owners), np.concatenate(cells), np.concatenate(weights)
+
+    def contacts_of(self, idx, shape):
+        """(cells, weights) for every cell that has one of the cells at flat indices idx as a contact"""
+        _, cells, weights = self.edges(idx, shape)
+        return cells, weights
+
+def moore(radius=1, a=1.625, b=1.625, periodic=False):
+    """Square neighbourhood of the given radius; offsets off both axes get weight a/4, the others b/4
+
+    With radius 1 this is the original 8-neighbour rule, with a weighting the
+    diagonal neighbours and b the vertical/horizontal ones.
+    """
+    offsets = [(dr, dc) for dr in range(radius, -radius - 1, -1) for dc in range(-radius, radius + 1) if (dr, dc) != (0, 0)]
+    weights = [(a if dr != 0 and dc != 0 else b)/4 for dr, dc in offsets]
+    return Stencil(offsets, weights, periodic)
+
+class ContactGraph(object):
+    """Arbitrary contacts between grid positions, as weighted directed edges src -> dst between flat cell indices
+
+    An infected cell at src adds weight*sqrt(u) to the infection pressure of
+    the cell at dst. Edges are kept sorted both ways, so the pressure on a set
+    of cells is a sparse gather and sum rather than a loop over cells.
+    """
+
+    def __init__(self, src, dst, weights, n_cells):
+        super(ContactGraph, self).__init__()
+        self.src = np.asarray(src, dtype=np.intp)
+        self.dst = np.asarray(dst, dtype=np.intp)
+        self.weights = np.broadcast_to(np.asarray(weights, dtype=float), self.src.shape).copy()
+        self.n_cells = n_cells
+
+        # CSR-style views of the edges grouped by destination and by source
+        self.in_order = np.argsort(self.dst, kind="stable")
+        self.in_ptr = np.searchsorted(self.dst[self.in_order], np.arange(n_cells + 1))
+        self.out_order = np.argsort(self.src, kind="stable")
+        self.out_ptr = np.searchsorted(self.src[self.out_order], np.arange(n_cells + 1))
+
+    @classmethod
+    def from_stencil(cls, stencil, shape):
+        """The edges a stencil gives on a grid of the given shape"""
+        n = shape[0]*shape[1]
+        src, dst, weights = stencil.edges(np.arange(n), shape)
+        return cls(src, dst, weights, n)
+
+    def __add__(self, other):
+        return ContactGraph(np.concatenate([self.src, other.src]), np.concatenate([self.dst, other.dst]),
+            np.concatenate([self.weights, other.weights]), self.n_cells)
+
+    def pad(self, mask, rows=True):
+        return mask
+
+    def exposed(self, infected, shape):
+        flat = infected.reshape(shape[:-2] + (-1,))
+        exposed = np.zeros(flat.shape, dtype=bool)
+        if flat.ndim == 1:
+            exposed[self.dst[flat[self.src]]] = True
+        else:
+            replicate, edge = np.nonzero(flat[:, self.src])
+            exposed[replicate, self.dst[edge]] = True
+        return exposed.reshape(shape)
+
+    def pressure(self, engine, idx, infected):
+        """Infection pressure for the cells in idx (an np.nonzero tuple), one draw per infected incoming edge"""
+        prefix = idx[:-2]
+        cells = idx[-2]*infected.shape[-1] + idx[-1]
+        owner, edges = gather_edges(self.in_order, self.in_ptr, cells)
+        flat = infected.reshape(infected.shape[:-2] + (-1,))
+        active = flat[tuple(p[owner] for p in prefix) + (self.src[edges],)]
+        owner, edges = owner[active], edges[active]
+
+        u = engine.uniform(tuple(p[owner] for p in prefix) + (owner,), "infection")
+        return np.bincount(owner, weights=self.weights[edges]*np.sqrt(u), minlength=len(cells))
+
+    def contacts_of(self, idx, shape):
+        _, edges = gather_edges(self.out_order, self.out_ptr, idx)
+        return self.dst[edges], self.weights[edges]
+
+def gather_edges(order, ptr, cells):
+    """(position in cells, edge) pairs for every edge of each cell, given edges grouped by cell in order/ptr"""
+    start = ptr[cells]
+    count = ptr[cells + 1] - start
+    owner = np.repeat(np.arange(len(cells)), count)
+    pos = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count) + np.repeat(start, count)
+    return owner, order[pos]
+
+def group_contacts(groups, weight):
+    """Every pair of cells sharing a group label (e.g. a household or workplace id) in contact; negative labels are no group"""
+    flat = np.asarray(groups).ravel()
+    cells = np.flatnonzero(flat >= 0)
+    order = cells[np.argsort(flat[cells], kind="stable")]
+    labels = flat[order]
+    starts = np.flatnonzero(np.concatenate([[True], labels[1:] != labels[:-1]])) if len(labels) else np.zeros(0, dtype=np.intp)
+    sizes = np.diff(np.concatenate([starts, [len(labels)]]))
+
+    size_of = np.repeat(sizes, sizes)
+    src_pos = np.repeat(np.arange(len(order)), size_of)
+    dst_pos = np.repeat(np.repeat(starts, sizes), size_of) + np.arange(size_of.sum()) - np.repeat(np.cumsum(size_of) - size_of, size_of)
+    keep = src_pos != dst_pos
+    return ContactGraph(order[src_pos[keep]], order[dst_pos[keep]], weight, flat.size)
+
+def load_contacts(path, shape, weight=1.625/4):
+    """Contacts from a file: a .npy grid of group labels, or edges (src, dst[, weight] as flat cell indices) in .npz or .csv"""
+    n = shape[0]*shape[1]
+    ext = os.path.splitext(path)[1]
+    if ext == ".npy":
+        return group_contacts(np.load(path), weight)
+    if ext == ".npz":
+        with np.load(path) as data:
+            weights = data["weight"] if "weight" in data else weight
+            return ContactGraph(data["src"], data["dst"], weights, n)
+    import pandas as pd # Only needed for CSV edge lists, and slow to import
+    df = pd.read_csv(path)
+    return ContactGraph(df["src"].to_numpy(), df["dst"].to_numpy(), df["weight"].to_numpy() if "weight" in df else weight, n)
@@ -0,0 +1,576 @@
+import numpy as np
+from contact import moore
+
+# Cell states, as stored in GridEngine.state
+DEAD = 0
+SUSCEPTIBLE = 1
+LATENT = 2
+INFECTED = 3
+RECOVERED = 4
+
+NUM_STATES = 5
+STATE_COLORS = np.array([[0, 0, 0], [255, 255, 255], [240, 240, 0], [255, 0, 0], [0, 255, 0]], dtype=np.uint8) # RGB, indexed by state
+LOG_ORDER = [SUSCEPTIBLE, LATENT, INFECTED, RECOVERED, DEAD] # Column order of log.csv
+ACTIVE_COLUMNS = [LOG_ORDER.index(LATENT), LOG_ORDER.index(INFECTED)] # The epidemic is over once these are all zero
+
+GROUP = "group" # Attribute holding each cell's demographic group index, if the population has groups
+
+# Independent random streams, one per simulation component
+STREAMS = ["init", "infection", "progression", "movement"]
+
+def make_streams(seed=None):
+    """numpy Generators for each of STREAMS, spawned from one seed (fresh entropy if None)"""
+    children = np.random.SeedSequence(seed).spawn(len(STREAMS))
+    return {name : np.random.default_rng(child) for name, child in zip(STREAMS, children)}
+
+def sorted_unique(a):
+    """np.unique for integer index arrays, via a plain sort"""
+    a = np.sort(a)
+    if len(a) == 0:
+        return a
+    return a[np.concatenate(([True], a[1:] != a[:-1]))]
+
+class GridEngine(object):
+    """Simulation grid kept in contiguous NumPy arrays and advanced with array operations
+
+    Arrays are (rows, cols), with streams a dict from make_streams; or
+    (replicates, rows, cols), with streams a list of such dicts, one per
+    replicate. Replicates advance together but draw from their own streams.
+
+    contact is a contact.Stencil or contact.ContactGraph; by default, the
+    8-neighbour stencil with weights a/4 (diagonal) and b/4.
+
+    attributes are extra per-cell arrays (e.g. demographic groups), shaped like
+    the grid, that the engine only carries along: movement permutes them with
+    the cells. With n_groups > 0, attributes[GROUP] gives each cell's group in
+    [0, n_groups), and counts() also tallies the states within each group.
+    """
+
+    def __init__(self, state, resistance, params, time_counter=None, a=1.625, b=1.625, streams=None, contact=None, attributes=None, n_groups=0):
+        super(GridEngine, self).__init__()
+        self.state = np.ascontiguousarray(state, dtype=np.uint8)
+        self.resistance = np.ascontiguousarray(resistance, dtype=np.float32)
+        if time_counter is None:
+            self.time_counter = np.zeros(self.state.shape, dtype=np.int16)
+        else:
+            self.time_counter = np.ascontiguousarray(time_counter, dtype=np.int16)
+        self.attributes = {name : np.ascontiguousarray(arr) for name, arr in (attributes or {}).items()}
+        for name, arr in self.attributes.items():
+            if arr.shape != self.state.shape:
+                raise ValueError(f"Attribute {name} has shape {arr.shape}, not the grid's {self.state.shape}")
+        if n_groups and GROUP not in self.attributes:
+            raise ValueError("Need a group attribute to count by group")
+        self.n_groups = n_groups
+        self.group_counts = None # Counts per group from the last counts() (see counts)
+
+        if streams is None:
+            streams = make_streams() if self.state.ndim == 2 else [make_streams() for i in range(self.state.shape[0])]
+        self.streams = streams
+        if self.batched and len(streams) != self.state.shape[0]:
+            raise ValueError("Need one set of random streams per replicate")
+
+        self.contact = contact if contact is not None else moore(1, a, b)
+        self.new_infections = np.zeros(self.state.shape[0], dtype=np.int64) if self.batched else 0 # Cells infected in the last step
+        self.set_params(params)
+
+    def refresh(self):
+        """Rebuild any cached indices after the state arrays were edited directly"""
+        pass
+
+    def close(self):
+        """Release any resources held outside the arrays"""
+        pass
+
+    def set_contact(self, contact):
+        self.contact = contact
+
+    def set_params(self, params):
+        self.max_latent = params["max_latent"]
+        self.max_infected = params["max_infected"]
+        self.prob_death = params["prob_death"]
+        self.max_immune = params["max_immune"]
+        self.max_movement_radius = params["max_movement_radius"]
+        self.movement_prob = params["movement_prob"]
+
+    @property
+    def shape(self):
+        return self.state.shape
+
+    def cell_arrays(self):
+        """Every per-cell array, all of which movement permutes together"""
+        return [self.state, self.time_counter, self.resistance] + list(self.attributes.values())
+
+    @property
+    def batched(self):
+        return self.state.ndim == 3
+
+    def counts(self):
+        """Number of cells in each state, ordered as in log.csv; (replicates, 5) when batched
+
+        With groups, the same bincount also sets group_counts to the counts
+        within each group: (groups, 5), or (replicates, groups, 5) when batched.
+        """
+        if not self.batched and not self.n_groups:
+            return np.bincount(self.state.ravel(), minlength=NUM_STATES)[LOG_ORDER]
+
+        n = self.state.shape[0] if self.batched else 1
+        groups = max(self.n_groups, 1)
+        keys = self.state.reshape(n, -1).astype(np.intp)
+        if self.n_groups:
+            keys += NUM_STATES*self.attributes[GROUP].reshape(n, -1).astype(np.intp)
+        keys += groups*NUM_STATES*np.arange(n, dtype=np.intp)[:, None]
+        by_group = np.bincount(keys.ravel(), minlength=n*groups*NUM_STATES).reshape(n, groups, NUM_STATES)[..., LOG_ORDER]
+        if self.n_groups:
+            self.group_counts = by_group if self.batched else by_group[0]
+        counts = by_group.sum(axis=1)
+        return counts if self.batched else counts[0]
+
+    def uniform(self, idx, stream, k=None):
+        """Uniform draws from stream for the cells in idx (an np.nonzero tuple), k per cell if given
+
+        Returns shape (n,) or (k, n). When batched, each replicate's cells are drawn
+        from that replicate's stream (np.nonzero orders idx by replicate).
+        """
+        n = len(idx[0])
+        if not self.batched:
+            return self.streams[stream].random(n if k is None else (k, n))
+
+        per_replicate = np.bincount(idx[0], minlength=len(self.streams))
+        parts = [streams[stream].random(m if k is None else (k, m)) for streams, m in zip(self.streams, per_replicate)]
+        return np.concatenate(parts, axis=-1)
+
+    def uniform_grid(self, stream):
+        """One uniform draw from stream per cell, shaped like the grid"""
+        if not self.batched:
+            return self.streams[stream].random(self.state.shape)
+        return np.stack([streams[stream].random(self.state.shape[1:]) for streams in self.streams])
+
+    def infection_probs(self, idx, infected_padded):
+        """Infection probability for the susceptible cells in idx, given the infected mask padded by pad_infected"""
+        # sqrt(u*(1-T_C)) == sqrt(u)*sqrt(1-T_C), so the resistance factor comes out of the sum
+        return np.sqrt(1 - self.resistance[idx])*self.contact.pressure(self, idx, infected_padded)
+
+    def pad_infected(self, infected):
+        """The infected mask with the border the contact structure reads past the grid edges"""
+        return self.contact.pad(infected)
+
+    def infection_step(self):
+        """Advance every cell by one timestep
+
+        All transitions are computed from the state at the start of the step.
+        Returns the per-state counts after the step and the flat indices of the
+        cells selected to move.
+        """
+        state = self.state
+        counter = self.time_counter
+
+        infected = state == INFECTED
+        infected_padded = self.pad_infected(infected)
+
+        # Only susceptible cells with at least one infected contact can be infected
+        candidates = np.nonzero((state == SUSCEPTIBLE) & self.contact.exposed(infected_padded, state.shape))
+        probs = self.infection_probs(candidates, infected_padded)
+        hit = self.uniform(candidates, "infection") < probs
+        new_latent = tuple(i[hit] for i in candidates)
+
+        latent = state == LATENT
+        recovered = state == RECOVERED
+        to_infected = latent & (counter > self.max_latent)
+        to_recovered = infected & (counter > self.max_infected)
+        to_susceptible = recovered & (counter > self.max_immune)
+
+        at_risk = infected & ~to_recovered
+        at_risk_idx = np.nonzero(at_risk)
+        dies = np.zeros_like(at_risk)
+        dies[at_risk_idx] = self.uniform(at_risk_idx, "progression") < self.prob_death
+
+        ticking = (latent & ~to_infected) | (at_risk & ~dies) | (recovered & ~to_susceptible)
+        counter[ticking] += 1
+
+        state[to_infected] = INFECTED
+        state[to_recovered] = RECOVERED
+        state[dies] = DEAD
+        state[to_susceptible] = SUSCEPTIBLE
+        counter[to_infected | to_recovered | dies | to_susceptible] = 0
+
+        state[new_latent] = LATENT
+        counter[new_latent] = 0
+        if self.batched:
+            self.new_infections = np.bincount(new_latent[0], minlength=state.shape[0])
+        else:
+            self.new_infections = len(new_latent[0])
+
+        to_move = np.flatnonzero(self.uniform_grid("movement") < self.movement_prob)
+        return self.counts(), to_move
+
+    def movement_targets(self, to_move):
+        """Flat index each mover swaps with: a jump of at most max_movement_radius, clamped to the grid"""
+        rows, cols = self.state.shape[-2:]
+        low, high = -self.max_movement_radius, self.max_movement_radius
+        if self.batched:
+            per_replicate = np.bincount(to_move // (rows*cols), minlength=len(self.streams))
+            jumps = np.concatenate([streams["movement"].integers(low=low, high=high, size=(m, 2))
+                for streams, m in zip(self.streams, per_replicate)])
+        else:
+            jumps = self.streams["movement"].integers(low=low, high=high, size=(len(to_move), 2))
+
+        base, rem = np.divmod(to_move, rows*cols)
+        r, c = np.divmod(rem, cols)
+        new_r = np.clip(r + jumps[:, 0], 0, rows - 1)
+        new_c = np.clip(c + jumps[:, 1], 0, cols - 1)
+        return base*rows*cols + new_r*cols + new_c
+
+    def movement_step(self, to_move):
+        """Swap each moving cell with its target; returns the targets"""
+        targets = self.movement_targets(to_move)
+        self.swap_cells(to_move, targets)
+        return targets
+
+    def swap_cells(self, to_move, targets):
+        """Swap the cells at flat indices to_move with those at targets, in order
+
+        Movers are processed in colour classes of (row, col) modulo twice the
+        movement radius. Two movers in the same class are far enough apart that
+        their swaps never share a cell, so each class is one vectorized swap,
+        and the classes compose into a single permutation of the touched cells
+        that is applied to every array with one gather.
+        """
+        rows, cols = self.state.shape[-2:]
+        period = max(2*self.max_movement_radius, 1)
+        r, c = np.divmod(to_move % (rows*cols), cols)
+        colour = (r % period)*period + (c % period)
+
+        touched = sorted_unique(np.concatenate([to_move, targets]))
+        src = np.searchsorted(touched, to_move)
+        dst = np.searchsorted(touched, targets)
+        holder = touched.copy() # holder[i]: original cell now at touched[i]
+
+        order = np.argsort(colour, kind="stable")
+        bounds = np.searchsorted(colour[order], np.arange(period*period + 1))
+        for k in range(period*period):
+            sel = order[bounds[k]:bounds[k + 1]]
+            holder[src[sel]], holder[dst[sel]] = holder[dst[sel]], holder[src[sel]]
+
+        for arr in self.cell_arrays():
+            flat = arr.reshape(-1)
+            flat[touched] = flat[holder]
+
+    def fast_forward(self, timesteps):
+        """Advance timesteps steps of a grid with no latent or infected cells, returning the counts after each
+
+        With nothing left to infect or die, the only transitions are recovered
+        cells turning susceptible once their counters pass max_immune, which
+        happens at a known step for each cell. Movement only permutes cells, so
+        it cannot change the counts and is skipped. With groups, group_counts is
+        left holding the counts per group after each step: (timesteps, groups, 5),
+        or (replicates, timesteps, groups, 5).
+        """
+        state = self.state
+        counter = self.time_counter
+        n = state.shape[0] if self.batched else 1
+        groups = max(self.n_groups, 1)
+        recovered = state == RECOVERED
+
+        # A recovered cell turns susceptible in step max_immune + 1 - counter (0 if already past)
+        wait = np.maximum(self.max_immune + 1 - counter.astype(np.int64), 0)
+        key = np.nonzero(recovered)[0]*groups if self.batched else np.zeros(np.count_nonzero(recovered), dtype=np.intp)
+        if self.n_groups:
+            key = key + self.attributes[GROUP][recovered]
+        turned = np.bincount(key*(timesteps + 1) + np.minimum(wait[recovered], timesteps), minlength=n*groups*(timesteps + 1))
+        turned = np.cumsum(turned.reshape(n, groups, timesteps + 1)[..., :timesteps], axis=2) # Turned susceptible by the end of each step
+
+        totals = self.counts().reshape(n, NUM_STATES)
+        start = self.group_counts.reshape(n, groups, NUM_STATES) if self.n_groups else totals.reshape(n, 1, NUM_STATES)
+        by_group = np.repeat(start[:, :, None, :], timesteps, axis=2).astype(np.int32) # (replicates, groups, timesteps, 5)
+        by_group[..., LOG_ORDER.index(SUSCEPTIBLE)] += turned
+        by_group[..., LOG_ORDER.index(RECOVERED)] -= turned
+        counts = by_group.sum(axis=1, dtype=np.int32)
+        if self.n_groups:
+            # One (groups, 5) array per step, as in counts()
+            by_step = by_group.transpose(0, 2, 1, 3)
+            self.group_counts = by_step if self.batched else by_step[0]
+
+        done = recovered & (wait < timesteps)
+        state[done] = SUSCEPTIBLE
+        counter[done] = 0
+        counter[recovered & ~done] += timesteps
+        self.refresh()
+        self.new_infections = self.new_infections*0
+        return counts if self.batched else counts[0]
+
+    def run(self, timesteps, stop_extinct=False):
+        """Advance timesteps steps, returning the counts after each: (timesteps, 5) or (replicates, timesteps, 5)
+
+        With stop_extinct, once no replicate has latent or infected cells left the
+        remaining steps are filled in with fast_forward.
+        """
+        counts = np.zeros(self.state.shape[:-2] + (timesteps, NUM_STATES), dtype=np.int32)
+        for t in range(timesteps):
+            counts[..., t, :], to_move = self.infection_step()
+            self.movement_step(to_move)
+            if stop_extinct and not counts[..., t, ACTIVE_COLUMNS].any():
+                counts[..., t + 1:, :] = self.fast_forward(timesteps - t - 1)
+                break
+        return counts
+
+class FrontierEngine(GridEngine):
+    """GridEngine that only visits the epidemic front
+
+    Keeps the flat indices of the latent, infected and recovered cells (the
+    ones whose counters tick), evaluates infection only for susceptible
+    contacts of infected cells, and picks movers by sampling the gaps between
+    them, so a step costs time proportional to the number of active cells
+    rather than to the grid area.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(FrontierEngine, self).__init__(*args, **kwargs)
+        if self.batched:
+            raise ValueError("FrontierEngine does not support replicates")
+        self.refresh()
+
+    def refresh(self):
+        flat = self.state.reshape(-1)
+        self.active = np.flatnonzero((flat == LATENT) | (flat == INFECTED) | (flat == RECOVERED))
+        groups = max(self.n_groups, 1)
+        everyone = np.arange(flat.size)
+        self.group_sizes = np.bincount(self.group_of(everyone), minlength=groups)
+        self.dead_by_group = np.bincount(self.group_of(everyone[flat == DEAD]), minlength=groups)
+
+    def group_of(self, idx):
+        """Group of each cell at flat indices idx (all 0 without groups)"""
+        if not self.n_groups:
+            return np.zeros(len(idx), dtype=np.intp)
+        return self.attributes[GROUP].reshape(-1)[idx].astype(np.intp)
+
+    def counts(self):
+        groups = max(self.n_groups, 1)
+        keys = NUM_STATES*self.group_of(self.active) + self.state.reshape(-1)[self.active]
+        by_group = np.bincount(keys, minlength=groups*NUM_STATES).reshape(groups, NUM_STATES)
+        by_group[:, DEAD] = self.dead_by_group
+        by_group[:, SUSCEPTIBLE] = self.group_sizes - by_group.sum(axis=1)
+        if self.n_groups:
+            self.group_counts = by_group[:, LOG_ORDER]
+        return by_group.sum(axis=0)[LOG_ORDER]
+
+    def new_latent(self, infected_idx):
+        """Flat indices of the susceptible cells infected this step by the cells in infected_idx"""
+        flat_state = self.state.reshape(-1)
+        cand, weights = self.contact.contacts_of(infected_idx, self.state.shape)
+
+        susceptible = flat_state[cand] == SUSCEPTIBLE
+        cand, weights = cand[susceptible], weights[susceptible]
+
+        # One draw per (cell, infected contact) pair, summed per cell as in prob_infection
+        cells, inverse = np.unique(cand, return_inverse=True)
+        rng = self.streams["infection"]
+        sums = np.bincount(inverse, weights=weights*np.sqrt(rng.random(len(cand))), minlength=len(cells))
+        probs = np.sqrt(1 - self.resistance.reshape(-1)[cells])*sums
+        return cells[rng.random(len(cells)) < probs]
+
+    def sample_movers(self):
+        """Flat indices of movers, distributed like one Bernoulli(movement_prob) draw per cell"""
+        n = self.state.size
+        p = self.movement_prob
+        if p <= 0:
+            return np.zeros(0, dtype=np.intp)
+        if p >= 1:
+            return np.arange(n)
+
+        # Gaps between successive movers are geometric
+        rng = self.streams["movement"]
+        expected = n*p
+        pos = np.cumsum(rng.geometric(p, size=int(expected + 5*np.sqrt(expected) + 10))) - 1
+        while pos[-1] < n:
+            more = pos[-1] + np.cumsum(rng.geometric(p, size=len(pos)))
+            pos = np.concatenate([pos, more])
+        return pos[pos < n]
+
+    def infection_step(self):
+        flat_state = self.state.reshape(-1)
+        flat_counter = self.time_counter.reshape(-1)
+
+        act = self.active
+        st = flat_state[act]
+        ctr = flat_counter[act]
+
+        new_latent = self.new_latent(act[st == INFECTED])
+
+        latent = st == LATENT
+        infected = st == INFECTED
+        recovered = st == RECOVERED
+        to_infected = latent & (ctr > self.max_latent)
+        to_recovered = infected & (ctr > self.max_infected)
+        to_susceptible = recovered & (ctr > self.max_immune)
+
+        at_risk = infected & ~to_recovered
+        dies = np.zeros_like(at_risk)
+        dies[at_risk] = self.streams["progression"].random(np.count_nonzero(at_risk)) < self.prob_death
+
+        ticking = (latent & ~to_infected) | (at_risk & ~dies) | (recovered & ~to_susceptible)
+        flat_counter[act[ticking]] += 1
+
+        st[to_infected] = INFECTED
+        st[to_recovered] = RECOVERED
+        st[dies] = DEAD
+        st[to_susceptible] = SUSCEPTIBLE
+        flat_state[act] = st
+        flat_counter[act[to_infected | to_recovered | dies | to_susceptible]] = 0
+
+        flat_state[new_latent] = LATENT
+        flat_counter[new_latent] = 0
+        self.new_infections = len(new_latent)
+
+        self.dead_by_group += np.bincount(self.group_of(act[dies]), minlength=len(self.dead_by_group))
+        self.active = sorted_unique(np.concatenate([act[(st != SUSCEPTIBLE) & (st != DEAD)], new_latent]))
+
+        return self.counts(), self.sample_movers()
+
+    def movement_step(self, to_move):
+        targets = super(FrontierEngine, self).movement_step(to_move)
+
+        # Only the cells at either end of a swap can have changed
+        touched = sorted_unique(np.concatenate([to_move, targets]))
+        touched_state = self.state.reshape(-1)[touched]
+        now_active = touched[(touched_state == LATENT) | (touched_state == INFECTED) | (touched_state == RECOVERED)]
+        self.active = sorted_unique(np.concatenate([np.setdiff1d(self.active, touched, assume_unique=True), now_active]))
+        return targets
+
+class CalendarEngine(FrontierEngine):
+    """FrontierEngine that schedules the timed transitions instead of ticking counters
+
+    When a cell becomes latent, infected or recovered, the step in which its
+    counter will pass max_latent, max_infected or max_immune is already known,
+    so the cell is filed in a calendar under that step. A step then visits only
+    the cells due in it, the infected cells (for the infection and death
+    draws) and the movers. Each cell keeps the step its counter was last 0, and
+    time_counter is rebuilt from those when it is read. The counts are updated
+    with each step's transitions rather than recounted.
+
+    Draws are made in the same order as in FrontierEngine, so both give the
+    same run from the same streams.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.now = 0 # Steps taken
+        self.calendar = None # {step : [flat indices of cells due to change state in that step]}
+        self.counters_stale = False
+        super(CalendarEngine, self).__init__(*args, **kwargs)
+
+    @property
+    def time_counter(self):
+        """Counters as in GridEngine, rebuilt from the entry steps if a step was taken since they were last read"""
+        if self.counters_stale:
+            flat = self.state.reshape(-1)
+            timed = (flat == LATENT) | (flat == INFECTED) | (flat == RECOVERED)
+            counter = self._time_counter.reshape(-1)
+            counter[:] = 0
+            counter[timed] = self.now - self.entered.reshape(-1)[timed]
+            self.counters_stale = False
+        return self._time_counter
+
+    @time_counter.setter
+    def time_counter(self, value):
+        self._time_counter = value
+
+    def cell_arrays(self):
+        # Movement carries the entry steps; time_counter is rebuilt from them
+        return [self.state, self.entered, self.resistance] + list(self.attributes.values())
+
+    def set_params(self, params):
+        super(CalendarEngine, self).set_params(params)
+        self.periods = np.array([0, 0, self.max_latent, self.max_infected, self.max_immune], dtype=np.int64) # Indexed by state
+        if self.calendar is not None:
+            self.refresh() # Cells already filed are due at different steps now
+
+    def refresh(self):
+        counter = self.time_counter.reshape(-1)
+        flat = self.state.reshape(-1)
+        timed = np.flatnonzero((flat == LATENT) | (flat == INFECTED) | (flat == RECOVERED))
+        self.entered = np.zeros(self.state.shape, dtype=np.int32)
+        self.entered.reshape(-1)[timed] = self.now - counter[timed]
+        self.infected = np.flatnonzero(flat == INFECTED)
+
+        groups = max(self.n_groups, 1)
+        keys = NUM_STATES*self.group_of(np.arange(flat.size)) + flat
+        self.by_group = np.bincount(keys, minlength=groups*NUM_STATES).reshape(groups, NUM_STATES)
+
+        self.calendar = {}
+        self.schedule(timed)
+
+    def due(self, idx):
+        """Step in which each timed cell at flat indices idx changes state, the first in which its counter exceeds the maximum"""
+        due = self.entered.reshape(-1)[idx] + self.periods[self.state.reshape(-1)[idx]] + 2
+        return np.maximum(due, self.now + 1) # Overdue after the maximum was lowered
+
+    def schedule(self, idx):
+        """File the timed cells at flat indices idx in the calendar under their due steps"""
+        due = self.due(idx)
+        order = np.argsort(due, kind="stable")
+        steps, starts = np.unique(due[order], return_index=True)
+        for step, cells in zip(steps, np.split(idx[order], starts[1:])):
+            self.calendar.setdefault(int(step), []).append(cells)
+
+    def pop_due(self, step):
+        """Flat indices of the cells due in step, by state: (latent, infected, recovered)"""
+        filed = self.calendar.pop(step, [])
+        cells = sorted_unique(np.concatenate(filed)) if filed else np.zeros(0, dtype=np.intp)
+
+        # Entries go stale when cells move, die or are filed again after moving
+        st = self.state.reshape(-1)[cells]
+        timed = (st == LATENT) | (st == INFECTED) | (st == RECOVERED)
+        cells, st = cells[timed], st[timed]
+        current = self.due(cells) == step
+        cells, st = cells[current], st[current]
+        return cells[st == LATENT], cells[st == INFECTED], cells[st == RECOVERED]
+
+    def counts(self):
+        if self.n_groups:
+            self.group_counts = self.by_group[:, LOG_ORDER]
+        return self.by_group.sum(axis=0)[LOG_ORDER]
+
+    def infection_step(self):
+        flat_state = self.state.reshape(-1)
+        step = self.now + 1
+
+        new_latent = self.new_latent(self.infected)
+        to_infected, to_recovered, to_susceptible = self.pop_due(step)
+
+        at_risk = np.setdiff1d(self.infected, to_recovered, assume_unique=True)
+        dies = self.streams["progression"].random(len(at_risk)) < self.prob_death
+
+        changed = np.concatenate([to_infected, to_recovered, at_risk[dies], to_susceptible, new_latent])
+        groups = NUM_STATES*self.group_of(changed)
+        size = self.by_group.size
+        self.by_group -= np.bincount(groups + flat_state[changed], minlength=size).reshape(self.by_group.shape)
+
+        flat_state[to_infected] = INFECTED
+        flat_state[to_recovered] = RECOVERED
+        flat_state[at_risk[dies]] = DEAD
+        flat_state[to_susceptible] = SUSCEPTIBLE
+        flat_state[new_latent] = LATENT
+        self.by_group += np.bincount(groups + flat_state[changed], minlength=size).reshape(self.by_group.shape)
+
+        entering = np.concatenate([to_infected, to_recovered, new_latent])
+        self.entered.reshape(-1)[entering] = step
+        self.now = step
+        self.counters_stale = True
+        self.schedule(entering)
+
+        self.infected = sorted_unique(np.concatenate([at_risk[~dies], to_infected]))
+        self.new_infections = len(new_latent)
+        return self.counts(), self.sample_movers()
+
+    def movement_step(self, to_move):
+        targets = super(FrontierEngine, self).movement_step(to_move)
+        self.counters_stale = True
+
+        # Cells moved away from where they were filed, so file them again where they are now
+        touched = sorted_unique(np.concatenate([to_move, targets]))
+        touched_state = self.state.reshape(-1)[touched]
+        self.infected = sorted_unique(np.concatenate([np.setdiff1d(self.infected, touched, assume_unique=True), touched[touched_state == INFECTED]]))
+        self.schedule(touched[(touched_state == LATENT) | (touched_state == INFECTED) | (touched_state == RECOVERED)])
+        return targets
+
+# Engines selectable by name, e.g. with --engine
+ENGINES = {"grid" : GridEngine, "frontier" : FrontierEngine, "calendar" : CalendarEngine}
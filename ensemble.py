@@ -0,0 +1,146 @@
+import numpy as np
+import argparse
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from logger import COLUMNS
+from simulation import PARAM_NAMES, Simulation
+
+COEFFICIENTS = ["a", "b"] # Infection coefficients of the contact stencil, rather than simulation params
+
+def member_seed(base_seed, replicate):
+    """Seed for one replicate; the same replicate uses the same seed in every parameter set"""
+    return int(np.random.SeedSequence([base_seed, replicate]).generate_state(1)[0])
+
+def check_names(names):
+    unknown = [name for name in names if name not in PARAM_NAMES + COEFFICIENTS]
+    if unknown:
+        raise ValueError(f"Unknown parameters {', '.join(unknown)}; expected any of {', '.join(PARAM_NAMES + COEFFICIENTS)}")
+
+def parse_grid(specs):
+    """Turn ["max_latent=3,5", "prob_death=0.001"] into a list of param override dicts"""
+    names = []
+    values = []
+    for spec in specs:
+        name, vals = spec.split("=")
+        check_names([name])
+        names.append(name)
+        values.append([float(v) if "." in v or "e" in v else int(v) for v in vals.split(",")])
+    return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+def apply_overrides(sim, overrides):
+    """Set the params and contact coefficients (a, b) in overrides on sim, raising ValueError for any other name"""
+    check_names(overrides)
+    params = sim.get_params()
+    params.update({name : value for name, value in overrides.items() if name not in COEFFICIENTS})
+    sim.set_params_from_config(params)
+    contact = {name : value for name, value in overrides.items() if name in COEFFICIENTS}
+    if contact:
+        sim.set_contact_from_config(contact)
+
+def run_member(init_config, overrides, timesteps, seed):
+    """Run one trajectory and return its (timesteps, 5) counts"""
+    sim = Simulation(run_time=timesteps, load_path=init_config, seed=seed)
+    apply_overrides(sim, overrides)
+
+    # Runs that die out are finished with fast_forward; their counts are the same as if they had been stepped
+    return sim.engine.run(timesteps, stop_extinct=True)
+
+def run_batch(init_config, overrides, timesteps, seeds):
+    """Run one replicate per seed together in a single batched engine, returning (len(seeds), timesteps, 5) counts"""
+    sim = Simulation(run_time=timesteps, load_path=init_config, seed=seeds[0]) # Loaded grid or settings the replicates start from (see make_batch_engine)
+    apply_overrides(sim, overrides)
+
+    return sim.make_batch_engine(seeds).run(timesteps, stop_extinct=True)
+
+def summarize(runs, quantiles):
+    """Per-timestep mean and quantiles over the replicates in runs, shape (n, T, 5)"""
+    mean = runs.mean(axis=0)
+    q = np.quantile(runs, quantiles, axis=0)
+    return mean, q
+
+def write_summary(path, param_sets, runs, n_runs, quantiles):
+    timesteps = runs.shape[1]
+    with open(path, "w") as f:
+        header = ["set", "timestep"]
+        for col in COLUMNS:
+            header.append(col + "_mean")
+            header += [col + "_q" + str(qt) for qt in quantiles]
+        f.write(",".join(header) + "\n")
+
+        for i in range(len(param_sets)):
+            mean, q = summarize(np.asarray(runs[i*n_runs:(i + 1)*n_runs]), quantiles)
+            for t in range(timesteps):
+                row = [str(i), str(t)]
+                for s in range(len(COLUMNS)):
+                    row.append(str(mean[t, s]))
+                    row += [str(q[k, t, s]) for k in range(len(quantiles))]
+                f.write(",".join(row) + "\n")
+
+def run_ensemble(out_path, init_config, param_sets, n_runs, timesteps, base_seed=0, quantiles=(0.05, 0.5, 0.95), max_workers=None, batch_size=1):
+    """Run n_runs replicates of every parameter set in parallel
+
+    Counts are streamed into out_path/runs.npy (memory-mapped, one row per run) as
+    runs finish; runs.csv indexes the rows and summary.csv holds per-timestep
+    mean/quantiles for each parameter set. With batch_size > 1, each worker task
+    advances up to batch_size replicates together in one batched engine.
+    """
+    os.makedirs(out_path, exist_ok=True)
+    n_total = len(param_sets)*n_runs
+    runs = np.lib.format.open_memmap(os.path.join(out_path, "runs.npy"), mode="w+", dtype=np.int32,
+        shape=(n_total, timesteps, len(COLUMNS)))
+
+    with open(os.path.join(out_path, "runs.csv"), "w") as f:
+        f.write("run,set,replicate,seed,params\n")
+        for i, overrides in enumerate(param_sets):
+            for j in range(n_runs):
+                params = ";".join([k + "=" + str(v) for k, v in overrides.items()])
+                f.write(",".join([str(i*n_runs + j), str(i), str(j), str(member_seed(base_seed, j)), params]) + "\n")
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for i, overrides in enumerate(param_sets):
+            for start in range(0, n_runs, batch_size):
+                seeds = [member_seed(base_seed, j) for j in range(start, min(start + batch_size, n_runs))]
+                if batch_size == 1:
+                    future = executor.submit(run_member, init_config, overrides, timesteps, seeds[0])
+                else:
+                    future = executor.submit(run_batch, init_config, overrides, timesteps, seeds)
+                futures[future] = i*n_runs + start
+
+        n_done = 0
+        for future in as_completed(futures):
+            counts = future.result().reshape(-1, timesteps, len(COLUMNS))
+            runs[futures[future]:futures[future] + len(counts)] = counts
+            n_done += len(counts)
+            print(f"{n_done}/{n_total} runs done", end="\r")
+    print()
+    runs.flush()
+
+    write_summary(os.path.join(out_path, "summary.csv"), param_sets, runs, n_runs, list(quantiles))
+    return runs
+
+def main():
+    parser = argparse.ArgumentParser(description='Run an ensemble of disease spread simulations.')
+    parser.add_argument("--out_path", type=str, help='path to save ensemble results', default=os.path.join("ensembles", datetime.now().strftime("ensemble_%d_%m_%Y_%H_%M_%S")))
+    parser.add_argument("--init_config", type=str, help='path to init config file', default="")
+    parser.add_argument("--runs", type=int, help='replicates per parameter set', default=100)
+    parser.add_argument("--timesteps", type=int, help='timesteps to run each simulation', default=1500)
+    parser.add_argument("--seed", type=int, help='base seed; replicate seeds are derived from it', default=0)
+    parser.add_argument("--grid", nargs='+', help='parameter grid, e.g. max_latent=3,5,7 prob_death=0.001,0.002; a and b sweep the contact coefficients', default=[])
+    parser.add_argument("--quantiles", nargs='+', type=float, help='quantiles to report per timestep', default=[0.05, 0.5, 0.95])
+    parser.add_argument("--batch_size", type=int, help='replicates advanced together in one batched engine per task', default=1)
+    parser.add_argument("--workers", type=int, help='number of worker processes (default: all cores)', default=None)
+
+    args = parser.parse_args()
+    print("Saving to: " + args.out_path)
+
+    try:
+        param_sets = parse_grid(args.grid)
+    except ValueError as e:
+        parser.error(str(e))
+    run_ensemble(args.out_path, args.init_config, param_sets, args.runs, args.timesteps, args.seed, args.quantiles, args.workers, args.batch_size)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import numpy as np
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, GifImagePlugin
+from engine import STATE_COLORS
+from recorder import FrameReader
+
+FORMATS = ["gif", "png", "video"]
+PALETTE = STATE_COLORS.ravel().tolist() # States are already palette indices
+
+def to_pixels(frame, scale=1):
+    """States in image order, with a scale x scale block of pixels per cell
+
+    Row 0 of the grid is drawn at the bottom of the window, so rows are flipped.
+    """
+    frame = np.asarray(frame)[::-1]
+    if scale > 1:
+        frame = np.repeat(np.repeat(frame, scale, axis=0), scale, axis=1)
+    return np.ascontiguousarray(frame, dtype=np.uint8)
+
+def to_image(frame, scale=1):
+    """Palette image of a state grid, coloured like the pyglet window"""
+    im = Image.fromarray(to_pixels(frame, scale), mode="P")
+    im.putpalette(PALETTE)
+    return im
+
+def encode_gif(frames_path, start, stop, scale, duration):
+    """GIF image blocks (local header and LZW data) for frames start to stop"""
+    reader = FrameReader(frames_path)
+    data = []
+    for i in range(start, stop):
+        data += GifImagePlugin.getdata(to_image(reader[i], scale), duration=duration)
+    return b"".join(data)
+
+def write_png(frames_path, start, stop, scale, out_path):
+    reader = FrameReader(frames_path)
+    for i in range(start, stop):
+        to_image(reader[i], scale).save(os.path.join(out_path, f"frame_{reader.timesteps[i]:06d}.png"))
+
+def render_rgb(frames_path, start, stop, scale):
+    reader = FrameReader(frames_path)
+    return np.stack([STATE_COLORS[to_pixels(reader[i], scale)] for i in range(start, stop)])
+
+def map_chunks(fn, frames_path, n_frames, chunk_size, max_workers, *args):
+    """Yield fn(frames_path, start, stop, *args) for consecutive chunks of frames, in order
+
+    Chunks are processed in parallel, but only a couple per worker are in flight
+    at a time so memory stays bounded however long the run is.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = 2*(max_workers or os.cpu_count() or 1)
+        pending = []
+        for start in range(0, n_frames, chunk_size):
+            pending.append(executor.submit(fn, frames_path, start, min(start + chunk_size, n_frames), *args))
+            if len(pending) >= in_flight:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+def export_gif(frames_path, out_file, scale=1, fps=10, chunk_size=16, max_workers=None):
+    """Stream frames into an animated GIF; workers encode chunks and this process writes them in order"""
+    reader = FrameReader(frames_path)
+    header, _ = GifImagePlugin.getheader(to_image(np.zeros(reader.shape, dtype=np.uint8), scale), info={"loop" : 0})
+    with open(out_file, "wb") as f:
+        for block in header:
+            f.write(block)
+        for data in map_chunks(encode_gif, frames_path, len(reader), chunk_size, max_workers, scale, int(1000/fps)):
+            f.write(data)
+        f.write(b";") # GIF trailer
+
+def export_png(frames_path, out_path, scale=1, chunk_size=16, max_workers=None):
+    """Write one frame_<timestep>.png per recorded frame"""
+    os.makedirs(out_path, exist_ok=True)
+    for _ in map_chunks(write_png, frames_path, len(FrameReader(frames_path)), chunk_size, max_workers, scale, out_path):
+        pass
+
+def export_video(frames_path, out_file, scale=1, fps=10, chunk_size=16, max_workers=None):
+    """Encode frames to a video file (e.g. .mp4) with imageio's ffmpeg writer"""
+    try:
+        import imageio.v2 as imageio
+    except ImportError:
+        raise ImportError("Video export needs imageio and imageio-ffmpeg (pip install imageio imageio-ffmpeg)")
+
+    writer = imageio.get_writer(out_file, fps=fps, macro_block_size=1)
+    try:
+        for rgb in map_chunks(render_rgb, frames_path, len(FrameReader(frames_path)), chunk_size, max_workers, scale):
+            for frame in rgb:
+                writer.append_data(frame)
+    finally:
+        writer.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Export recorded state frames as a GIF, PNG sequence or video.')
+    parser.add_argument("--dir", type=str, help='path for simulation results (frames are read from <dir>/frames)')
+    parser.add_argument("--format", type=str, help='output format', choices=FORMATS, default="gif")
+    parser.add_argument("--out", type=str, help='output file, or directory for png (default: inside --dir)', default=None)
+    parser.add_argument("--scale", type=int, help='pixels per cell along each side', default=4)
+    parser.add_argument("--fps", type=float, help='frames per second for gif/video', default=10)
+    parser.add_argument("--chunk_size", type=int, help='frames per worker task', default=16)
+    parser.add_argument("--workers", type=int, help='number of worker processes (default: all cores)', default=None)
+
+    args = parser.parse_args()
+    frames_path = os.path.join(args.dir, "frames")
+    default_out = {"gif" : "run.gif", "png" : "png", "video" : "run.mp4"}[args.format]
+    out = args.out if args.out is not None else os.path.join(args.dir, default_out)
+    print("Exporting to: " + out)
+
+    if args.format == "gif":
+        export_gif(frames_path, out, args.scale, args.fps, args.chunk_size, args.workers)
+    elif args.format == "png":
+        export_png(frames_path, out, args.scale, args.chunk_size, args.workers)
+    else:
+        export_video(frames_path, out, args.scale, args.fps, args.chunk_size, args.workers)
+
+if __name__ == '__main__':
+    main()
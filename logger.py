@@ -0,0 +1,123 @@
+import numpy as np
+import argparse
+import json
+import os
+
+COLUMNS = ["susceptible", "latent", "infected", "recovered", "dead"]
+RECORD_DTYPE = np.dtype("<i8") # Each logged step is len(COLUMNS) little-endian int64s
+
+class CSVLogger(object):
+    """Writes the per-step counts to <name>.csv (log.csv by default), one line per step
+
+    With resume_at, an existing log is truncated to its first resume_at steps
+    and appended to.
+    """
+
+    def __init__(self, log_path, resume_at=None, name="log", columns=COLUMNS):
+        super(CSVLogger, self).__init__()
+        os.makedirs(log_path, exist_ok=True)
+        path = os.path.join(log_path, name + ".csv")
+        if resume_at is None:
+            self.f = open(path, "w")
+            self.f.write(",".join(columns) + "\n")
+            self.steps = 0
+        else:
+            with open(path, "r+b") as f:
+                for i in range(resume_at + 1): # Header, then one line per step
+                    f.readline()
+                f.truncate(f.tell())
+            self.f = open(path, "a")
+            self.steps = resume_at
+
+    def log(self, counts):
+        self.f.write(",".join([str(n) for n in counts]))
+        self.f.write("\n")
+        self.steps += 1
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+class BinaryLogger(object):
+    """Buffers the per-step counts and appends them to <name>.bin (log.bin by default) as fixed-width records every block_size steps
+
+    With resume_at, an existing log is truncated to its first resume_at steps
+    and appended to.
+    """
+
+    def __init__(self, log_path, resume_at=None, name="log", columns=COLUMNS, block_size=1024):
+        super(BinaryLogger, self).__init__()
+        os.makedirs(log_path, exist_ok=True)
+        path = os.path.join(log_path, name + ".bin")
+        if resume_at is None:
+            self.f = open(path, "wb")
+            self.steps = 0
+        else:
+            self.f = open(path, "r+b")
+            self.f.truncate(resume_at*len(columns)*RECORD_DTYPE.itemsize)
+            self.f.seek(0, os.SEEK_END)
+            self.steps = resume_at
+        self.buffer = np.zeros((block_size, len(columns)), dtype=RECORD_DTYPE)
+        self.n = 0
+
+    def log(self, counts):
+        self.buffer[self.n] = counts
+        self.n += 1
+        self.steps += 1
+        if self.n == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        self.f.write(self.buffer[:self.n].tobytes())
+        self.f.flush()
+        self.n = 0
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+LOGGERS = {"csv" : CSVLogger, "binary" : BinaryLogger}
+
+def read_counts(log_path, name="log", columns=COLUMNS, start=0, stop=None):
+    """Logged counts of steps [start, stop) as an (n_steps, len(columns)) array; memory-mapped rather than parsed when <name>.bin exists"""
+    bin_path = os.path.join(log_path, name + ".bin")
+    if not os.path.exists(bin_path):
+        import pandas as pd # Only needed for CSV logs, and slow to import
+        nrows = None if stop is None else max(stop - start, 0)
+        return pd.read_csv(os.path.join(log_path, name + ".csv"), skiprows=range(1, start + 1), nrows=nrows)[columns].to_numpy()
+
+    steps = os.path.getsize(bin_path)//(RECORD_DTYPE.itemsize*len(columns)) # A partly written last step is left out
+    if steps == 0:
+        return np.zeros((0, len(columns)), dtype=RECORD_DTYPE)
+    return np.memmap(bin_path, dtype=RECORD_DTYPE, mode="r", shape=(steps, len(columns)))[start:stop]
+
+def read_log(log_path):
+    """Logged counts as a DataFrame with the log.csv columns, wrapping read_counts without copying"""
+    import pandas as pd
+    return pd.DataFrame(read_counts(log_path), columns=COLUMNS, copy=False)
+
+def group_columns(groups):
+    """Columns of the per-group log: each of COLUMNS for every group, named <group>:<column>"""
+    return [group + ":" + column for group in groups for column in COLUMNS]
+
+def read_group_log(log_path):
+    """Per-group counts as a DataFrame with (group, state) column pairs, using the group names in groups.json"""
+    with open(os.path.join(log_path, "groups.json")) as f:
+        groups = json.load(f)["groups"]
+    import pandas as pd
+    counts = read_counts(log_path, "groups", group_columns(groups))
+    return pd.DataFrame(counts, columns=pd.MultiIndex.from_product([groups, COLUMNS], names=["group", "state"]), copy=False)
+
+def export_csv(log_path):
+    """Write log.csv next to a binary log"""
+    np.savetxt(os.path.join(log_path, "log.csv"), read_counts(log_path), fmt="%d", delimiter=",",
+        header=",".join(COLUMNS), comments="")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a binary simulation log to CSV.')
+    parser.add_argument("--dir", type=str, help='path for simulation results')
+
+    args = parser.parse_args()
+    export_csv(args.dir)
@@ -1,18 +1,24 @@
-import matplotlib.pyplot as plt
-import pandas as pd
 import argparse
-import os
+from logger import read_log
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Plot simulation data on disease spread.')
     parser.add_argument("--dir", type=str, help='path for simulation results')
+    parser.add_argument("--out", type=str, help='image file to save the plot to (default: show it)', default=None)
 
     args = parser.parse_args()
-    df = pd.read_csv(os.path.join(args.dir, "log.csv"))
+    df = read_log(args.dir)
 
-    unique = df.apply(lambda x: x["susceptible"] + x["latent"] + x["infected"] + x["recovered"] + x["dead"], axis=1).unique()
+    unique = df.sum(axis=1).unique() # Total cells, which should be the same every step
     print(unique)
 
     assert len(unique) == 1
+    import matplotlib
+    if args.out is not None:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
     df.plot()
-    plt.show()
+    if args.out is None:
+        plt.show()
+    else:
+        plt.savefig(args.out)
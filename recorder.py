@@ -0,0 +1,165 @@
+import numpy as np
+import json
+import os
+import zlib
+
+INDEX_DTYPE = np.dtype([("timestep", "<i8"), ("offset", "<i8"), ("length", "<i8")])
+
+class FrameWriter(object):
+    """Append-only store of same-shaped grids, e.g. cell states every K steps
+
+    Uncompressed frames are raw bytes in <name>.frames, so readers can memory-map
+    them. Compressed frames are XOR deltas against the previous frame (states
+    change in few cells per step), zlib-compressed, with a full keyframe every
+    keyframe_every frames to bound the work needed to decode any one frame.
+    <name>.idx holds a (timestep, offset, length) record per frame.
+
+    With resume_at, existing frames after timestep resume_at are dropped and new
+    frames are appended.
+    """
+
+    def __init__(self, path, name, shape, dtype, compress=False, keyframe_every=32, resume_at=None):
+        super(FrameWriter, self).__init__()
+        os.makedirs(path, exist_ok=True)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.compress = compress
+        self.keyframe_every = keyframe_every
+
+        frames_path = os.path.join(path, name + ".frames")
+        index_path = os.path.join(path, name + ".idx")
+        self.offset = 0
+        self.n = 0
+        self.prev = None
+
+        if resume_at is None:
+            meta = {"shape" : list(self.shape), "dtype" : self.dtype.str, "compress" : compress, "keyframe_every" : keyframe_every}
+            with open(os.path.join(path, name + ".json"), "w") as f:
+                json.dump(meta, f)
+            self.f = open(frames_path, "wb")
+            self.index = open(index_path, "wb")
+            return
+
+        index = np.fromfile(index_path, dtype=INDEX_DTYPE)
+        index = index[index["timestep"] <= resume_at]
+        self.n = len(index)
+        if self.n > 0:
+            self.offset = int(index["offset"][-1] + index["length"][-1])
+        with open(frames_path, "r+b") as f:
+            f.truncate(self.offset)
+        with open(index_path, "r+b") as f:
+            f.truncate(self.n*INDEX_DTYPE.itemsize)
+        if compress and self.n > 0:
+            self.prev = FrameReader(path, name)[self.n - 1].copy()
+
+        self.f = open(frames_path, "ab")
+        self.index = open(index_path, "ab")
+
+    def write(self, timestep, frame):
+        frame = np.ascontiguousarray(frame, dtype=self.dtype)
+        if self.compress:
+            if self.n % self.keyframe_every == 0:
+                data = zlib.compress(frame.tobytes(), 1)
+            else:
+                data = zlib.compress(np.bitwise_xor(frame.view(np.uint8), self.prev.view(np.uint8)).tobytes(), 1)
+            self.prev = frame.copy()
+        else:
+            data = frame.tobytes()
+
+        self.f.write(data)
+        self.index.write(np.array([(timestep, self.offset, len(data))], dtype=INDEX_DTYPE).tobytes())
+        self.offset += len(data)
+        self.n += 1
+
+    def flush(self):
+        self.f.flush()
+        self.index.flush()
+
+    def close(self):
+        self.f.close()
+        self.index.close()
+
+class FrameReader(object):
+    """Random access, by position or by timestep, to frames written by FrameWriter"""
+
+    def __init__(self, path, name="state"):
+        super(FrameReader, self).__init__()
+        with open(os.path.join(path, name + ".json")) as f:
+            meta = json.load(f)
+        self.shape = tuple(meta["shape"])
+        self.dtype = np.dtype(meta["dtype"])
+        self.compress = meta["compress"]
+        self.keyframe_every = meta["keyframe_every"]
+
+        self.index = np.fromfile(os.path.join(path, name + ".idx"), dtype=INDEX_DTYPE)
+        self.timesteps = self.index["timestep"]
+        frames_path = os.path.join(path, name + ".frames")
+        if len(self.index) == 0:
+            self.data = np.zeros(0, dtype=np.uint8)
+        elif self.compress:
+            self.data = np.memmap(frames_path, dtype=np.uint8, mode="r")
+        else:
+            self.data = np.memmap(frames_path, dtype=self.dtype, mode="r", shape=(len(self.index),) + self.shape)
+
+        self.cached = None # (position, frame) of the last decoded compressed frame
+
+    def __len__(self):
+        return len(self.index)
+
+    def decode(self, i):
+        offset, length = self.index["offset"][i], self.index["length"][i]
+        return np.frombuffer(zlib.decompress(self.data[offset:offset + length]), dtype=np.uint8)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not self.compress:
+            return self.data[i]
+
+        # Start from the cached frame when decoding forwards, else from the last keyframe
+        start = i - i % self.keyframe_every
+        if self.cached is not None and start <= self.cached[0] <= i:
+            pos, raw = self.cached[0], self.cached[1]
+        else:
+            pos, raw = start, self.decode(start)
+        for j in range(pos + 1, i + 1):
+            raw = np.bitwise_xor(raw, self.decode(j))
+        self.cached = (i, raw)
+        return raw.view(self.dtype).reshape(self.shape)
+
+    def at(self, timestep):
+        """The last frame recorded at or before timestep"""
+        i = np.searchsorted(self.timesteps, timestep, side="right") - 1
+        if i < 0:
+            raise KeyError("No frame recorded at or before timestep " + str(timestep))
+        return self[i]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+class FrameRecorder(object):
+    """Records the state grid (and optionally time counters) of a simulation every K steps"""
+
+    def __init__(self, path, shape, every=1, counters=False, compress=False, resume_at=None):
+        super(FrameRecorder, self).__init__()
+        self.every = every
+        self.state = FrameWriter(path, "state", shape, np.uint8, compress, resume_at=resume_at)
+        self.counters = FrameWriter(path, "time_counter", shape, np.int16, compress, resume_at=resume_at) if counters else None
+
+    def record(self, timestep, engine):
+        if timestep % self.every != 0:
+            return
+        self.state.write(timestep, engine.state)
+        if self.counters is not None:
+            self.counters.write(timestep, engine.time_counter)
+
+    def flush(self):
+        self.state.flush()
+        if self.counters is not None:
+            self.counters.flush()
+
+    def close(self):
+        self.state.close()
+        if self.counters is not None:
+            self.counters.close()
@@ -0,0 +1,46 @@
+import numpy as np
+import pyglet
+from engine import STATE_COLORS
+
+class GridRenderer(object):
+    """Draws a state grid as one persistent quad vertex list, rewriting only its colours when the states change"""
+
+    def __init__(self, shape, cell_size, y_offset=0, ratio=0.85):
+        super(GridRenderer, self).__init__()
+        rows, cols = shape
+        size = cell_size*ratio
+        offset = (cell_size - size)/2
+
+        # Quad corners (lower left, lower right, upper right, upper left) for every cell, row by row
+        row, col = np.mgrid[0:rows, 0:cols]
+        x0 = (col*cell_size + offset).ravel()
+        y0 = (row*cell_size + y_offset + offset).ravel()
+        x1 = x0 + size
+        y1 = y0 + size
+        vertices = np.stack([x0, y0, x1, y0, x1, y1, x0, y1], axis=1).astype(np.float32)
+
+        self.n = rows*cols
+        self.vertex_list = pyglet.graphics.vertex_list(4*self.n, ('v2f/static', vertices.ravel()),
+            ('c3B/stream', np.zeros(12*self.n, dtype=np.uint8)))
+
+    def update(self, state):
+        """Upload the colours for state through the STATE_COLORS lookup table"""
+        # Accessing .colors marks the buffer for upload; write into it through a numpy view
+        colors = np.ctypeslib.as_array(self.vertex_list.colors).reshape(self.n, 4, 3)
+        colors[:] = STATE_COLORS[state.reshape(self.n)][:, None, :]
+
+    def draw(self):
+        self.vertex_list.draw(pyglet.gl.GL_QUADS)
+
+    def delete(self):
+        self.vertex_list.delete()
+
+def add_toolbar_to_batch(batch, sim, width):
+    """Toolbar background and pause/save button along the bottom of a window"""
+    batch.add(4, pyglet.gl.GL_QUADS, None, ('v2f',
+        [0, 0, width, 0, width, sim.toolbar_size,
+        0, sim.toolbar_size]), ('c3B', [130 for i in range(12)]))
+
+    batch.add(4, pyglet.gl.GL_QUADS, None, ('v2f',
+        [sim.pause_bl_x, sim.pause_bl_y, 5*sim.pause_bl_x, sim.pause_bl_y, 5*sim.pause_bl_x, sim.pause_bl_y + (sim.toolbar_size*3/5),
+        sim.pause_bl_x, sim.pause_bl_y + (sim.toolbar_size*3/5)]), ('c3B', [200 for i in range(12)]))
@@ -0,0 +1,192 @@
+import numpy as np
+import argparse
+import os
+import ruamel.yaml
+from datetime import datetime
+from engine import LOG_ORDER, SUSCEPTIBLE
+from logger import COLUMNS
+from recorder import FrameReader
+from simulation import Simulation
+
+STATE_NAMES = dict(zip(COLUMNS, LOG_ORDER)) # e.g. "infected" -> INFECTED
+
+def uniform(shape):
+    """Equal weight everywhere"""
+    return np.ones(shape)
+
+def clusters(shape, centres):
+    """Sum of Gaussian bumps, one per (row, col, sigma[, weight]) in centres, each peaking at its weight (default 1)
+
+    Bumps are cut off beyond 5 sigma, where they have fallen below 1e-5 of their peak.
+    """
+    rows, cols = shape
+    weights = np.zeros(shape)
+    for centre in centres:
+        row, col, sigma = centre[:3]
+        peak = centre[3] if len(centre) > 3 else 1.0
+        r0, r1 = max(int(row - 5*sigma), 0), min(int(row + 5*sigma) + 1, rows)
+        c0, c1 = max(int(col - 5*sigma), 0), min(int(col + 5*sigma) + 1, cols)
+        # Separable, so each bump is an outer product of a column and a row profile
+        weights[r0:r1, c0:c1] += peak*np.outer(np.exp(-(np.arange(r0, r1) - row)**2/(2*sigma**2)), np.exp(-(np.arange(c0, c1) - col)**2/(2*sigma**2)))
+    return weights
+
+def rectangle(shape, row0, row1, col0, col1):
+    """Weight 1 on rows [row0, row1) and columns [col0, col1), 0 elsewhere"""
+    weights = np.zeros(shape)
+    weights[row0:row1, col0:col1] = 1
+    return weights
+
+def raster(shape, path):
+    """Weights from an image (its brightness, stretched to the grid, top of the image at the top of the grid) or an .npy array"""
+    if os.path.splitext(path)[1] == ".npy":
+        arr = np.load(path).astype(float)
+        rows = (np.arange(shape[0])*arr.shape[0]//shape[0])
+        cols = (np.arange(shape[1])*arr.shape[1]//shape[1])
+        return arr[np.ix_(rows, cols)]
+    from PIL import Image
+    image = Image.open(path).convert("L").resize((shape[1], shape[0]))
+    return np.flipud(np.asarray(image, dtype=float)) # Grid row 0 is drawn at the bottom
+
+PRIMITIVES = {"uniform" : uniform, "clusters" : clusters, "rectangle" : rectangle, "raster" : raster}
+
+def load_snapshot(path, timestep=None):
+    """(state, time_counter) grids of another run: a config directory, a checkpoint .npz or a frames directory
+
+    From frames, the last frame at or before timestep (default: the last
+    frame) is used. time_counter is None where it was not saved.
+    """
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            return data["state"], data["time_counter"]
+    if os.path.exists(os.path.join(path, "state.json")):
+        reader = FrameReader(path)
+        state = reader.at(timestep) if timestep is not None else reader[-1]
+        counters = None
+        if os.path.exists(os.path.join(path, "time_counter.json")):
+            counter_reader = FrameReader(path, "time_counter")
+            counters = counter_reader.at(timestep) if timestep is not None else counter_reader[-1]
+        return state, counters
+    counter_path = os.path.join(path, "time_counter.npy")
+    return np.load(os.path.join(path, "state.npy")), np.load(counter_path) if os.path.exists(counter_path) else None
+
+class Scenario(object):
+    """Initial state and time counter grids built up layer by layer
+
+    Weight maps from the primitives above (uniform, clusters, rectangle,
+    raster), combined with ordinary array arithmetic, say where a layer's cells
+    go; place() then picks cells at random in proportion to the weights, all
+    in a few array operations, so million-cell grids take milliseconds.
+    """
+
+    def __init__(self, shape, seed=None):
+        super(Scenario, self).__init__()
+        self.shape = tuple(shape)
+        self.rng = np.random.default_rng(seed)
+        self.state = np.full(self.shape, SUSCEPTIBLE, dtype=np.uint8)
+        self.time_counter = np.zeros(self.shape, dtype=np.int16)
+
+    def weights(self, name, *args):
+        return PRIMITIVES[name](self.shape, *args)
+
+    def place(self, state, weights=None, fraction=None, count=None, counter=0, overwrite=False):
+        """Set cells to state, chosen without replacement with probability proportional to weights
+
+        Places count cells, or fraction of the grid's cells, or every cell with
+        positive weight if neither is given. Only susceptible cells are chosen
+        unless overwrite. counter is the time counter of the placed cells, or a
+        (low, high) range to draw them from uniformly. Returns the number placed.
+        """
+        weights = uniform(self.shape) if weights is None else np.broadcast_to(weights, self.shape)
+        eligible = weights > 0
+        if not overwrite:
+            eligible &= self.state == SUSCEPTIBLE
+        cells = np.flatnonzero(eligible)
+        if count is None and fraction is not None:
+            count = int(round(fraction*self.state.size))
+        if count is not None and count < len(cells):
+            cells = cells[self.sample(weights.reshape(-1)[cells], count)]
+        self.state.reshape(-1)[cells] = state
+        if isinstance(counter, (list, tuple)):
+            counter = self.rng.integers(counter[0], counter[1] + 1, size=len(cells))
+        self.time_counter.reshape(-1)[cells] = counter
+        return len(cells)
+
+    def sample(self, w, count):
+        """count distinct positions in w, drawn one after another with probability proportional to w among those left"""
+        if w.min() == w.max():
+            return self.rng.choice(len(w), count, replace=False)
+        if count > len(w)//8:
+            # Exponential race: the count smallest of E/w (E ~ Exp(1)) are such a sample
+            return np.argpartition(self.rng.exponential(size=len(w))/w, count)[:count]
+        # Few picks: draw with replacement and top up until count distinct, which gives the same distribution
+        cdf = np.cumsum(w)
+        picked = np.zeros(0, dtype=np.intp)
+        while len(picked) < count:
+            more = np.searchsorted(cdf, self.rng.random(count - len(picked))*cdf[-1], side="right")
+            picked = np.unique(np.concatenate([picked, np.minimum(more, len(w) - 1)]))
+        return picked
+
+    def copy(self, state, time_counter=None, row=0, col=0):
+        """Paste grids (e.g. from load_snapshot) with their bottom left corner at (row, col), clipped to the grid"""
+        rows = min(state.shape[0], self.shape[0] - row)
+        cols = min(state.shape[1], self.shape[1] - col)
+        self.state[row:row + rows, col:col + cols] = state[:rows, :cols]
+        self.time_counter[row:row + rows, col:col + cols] = 0 if time_counter is None else time_counter[:rows, :cols]
+
+    def apply(self, layer):
+        """Apply one layer given as a dict, as in a scenario file (see README)"""
+        if "copy" in layer:
+            state, time_counter = load_snapshot(layer["copy"], layer.get("timestep"))
+            self.copy(state, time_counter, *layer.get("at", [0, 0]))
+            return
+        where = layer.get("where", "uniform")
+        weights = 1.0
+        for primitive in (where if isinstance(where, list) else [where]):
+            if isinstance(primitive, str):
+                weights = weights*self.weights(primitive)
+            else:
+                for name, args in primitive.items():
+                    weights = weights*(self.weights(name, args) if name in ("clusters", "raster") else self.weights(name, *args))
+        self.place(STATE_NAMES[layer["state"]], weights, layer.get("fraction"), layer.get("count"), layer.get("counter", 0),
+            layer.get("overwrite", False))
+
+    def save(self, save_path, cell_size=20, params=None, props=None, contact=None):
+        """Write the grid as a config directory loadable with --init_config, with params/props/contact overriding the defaults"""
+        rows, cols = self.shape
+        sim = Simulation(cell_size=cell_size, width=cols*cell_size, height=rows*cell_size, num_sample=0, seed=int(self.rng.integers(2**63)))
+        if params is not None:
+            sim.set_params_from_config(dict(sim.get_params(), **params))
+        if props is not None:
+            sim.set_props_from_config(dict({"mf_prop" : sim.mf_prop, "mf_influence" : sim.mf_influence, "age_prop" : sim.age_prop,
+                "age_influence" : sim.age_influence}, **props))
+            sim.init_cells() # Redraw the population from the new proportions
+        if contact is not None:
+            sim.set_contact_from_config(contact)
+        sim.engine.state[...] = self.state
+        sim.engine.time_counter[...] = self.time_counter
+        sim.config_logger.save_curr_config(os.path.join(save_path, "config.yml"))
+
+def build(spec):
+    """Scenario from a parsed scenario file"""
+    scenario = Scenario((spec["rows"], spec["cols"]), spec.get("seed"))
+    for layer in spec.get("layers", []):
+        scenario.apply(layer)
+    return scenario
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate an initial config from a scenario file of layers, without a window.')
+    parser.add_argument("scenario", type=str, help='YAML scenario file: rows, cols, layers and optionally seed, cell_size, params, props and contact')
+    parser.add_argument("--save_path", type=str, help='path to save config', default=os.path.join("configs", datetime.now().strftime("config_%d_%m_%Y_%H_%M_%S")))
+
+    args = parser.parse_args()
+    with open(args.scenario) as f:
+        spec = ruamel.yaml.YAML(typ="safe").load(f)
+
+    scenario = build(spec)
+    scenario.save(args.save_path, spec.get("cell_size", 20), spec.get("params"), spec.get("props"), spec.get("contact"))
+    counts = np.bincount(scenario.state.ravel(), minlength=len(COLUMNS))[LOG_ORDER]
+    print("Saved to: " + args.save_path)
+    print(", ".join([f"{name} {n}" for name, n in zip(COLUMNS, counts)]))
+
+if __name__ == '__main__':
+    main()
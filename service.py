@@ -0,0 +1,400 @@
+import numpy as np
+import argparse
+import asyncio
+import base64
+import collections
+import itertools
+import json
+import multiprocessing as mp
+import os
+from multiprocessing.connection import wait
+from logger import COLUMNS
+from simulation import CONTACT_ARGS, PARAM_NAMES, SIM_ENGINES, Simulation
+
+FINISHED = {"done", "cancelled", "failed"}
+INT_FIELDS = ["timesteps", "num_sample", "frame_every", "frame_scale"]
+SPEC_KEYS = {"params" : PARAM_NAMES, "props" : ["mf_prop", "mf_influence", "age_prop", "age_influence", "expected_resistance"],
+    "contact" : list(CONTACT_ARGS), "settings" : ["cell_size", "width", "modified_height"]} # Keys allowed in each dict field
+
+def check_spec(spec):
+    """Raise ValueError unless spec is a well-formed run submission (see make_run_simulation)"""
+    if not isinstance(spec, dict):
+        raise ValueError("body must be a JSON object")
+    is_int = lambda x: isinstance(x, int) and not isinstance(x, bool)
+    for name in spec:
+        if name not in INT_FIELDS + list(SPEC_KEYS) + ["seeds", "config", "engine"]:
+            raise ValueError(f"unknown field {name}")
+    for name in INT_FIELDS:
+        if name in spec and not is_int(spec[name]):
+            raise ValueError(f"{name} must be an integer")
+    if "seeds" in spec and not (isinstance(spec["seeds"], list) and all(s is None or is_int(s) for s in spec["seeds"])):
+        raise ValueError("seeds must be a list of integers or nulls")
+    if not isinstance(spec.get("config", ""), str):
+        raise ValueError("config must be a path")
+    if spec.get("engine", "grid") not in SIM_ENGINES:
+        raise ValueError(f"engine must be one of {', '.join(SIM_ENGINES)}")
+    for name, keys in SPEC_KEYS.items():
+        if name not in spec:
+            continue
+        if not isinstance(spec[name], dict):
+            raise ValueError(f"{name} must be an object")
+        unknown = [key for key in spec[name] if key not in keys]
+        if unknown:
+            raise ValueError(f"unknown {name} {', '.join(unknown)}; expected any of {', '.join(keys)}")
+
+def make_run_simulation(spec, seed):
+    """Simulation for one run submission
+
+    spec may name a saved config directory ("config") and override any part of
+    it with "params", "props" and "contact", as returned by get_config_no_grid.
+    Without a config, the grid comes from "settings" ("cell_size", "width" and
+    "modified_height") and "num_sample" randomly infected cells.
+    """
+    settings = spec.get("settings", {})
+    sim = Simulation(None, spec.get("timesteps", 1500), cell_size=settings.get("cell_size", 20), width=settings.get("width", 640),
+        height=settings.get("modified_height", 640), load_path=spec.get("config", ""), num_sample=spec.get("num_sample", 1),
+        engine=spec.get("engine", "grid"), seed=seed)
+    if "params" in spec:
+        sim.set_params_from_config(dict(sim.get_params(), **spec["params"]))
+    if "contact" in spec:
+        sim.set_contact_from_config(spec["contact"])
+    if "props" in spec:
+        # New proportions mean a new population; the cell states are kept
+        props = dict(sim.get_config_no_grid()["props"], **spec["props"])
+        if "expected_resistance" not in spec["props"]:
+            del props["expected_resistance"]
+        sim.set_props_from_config(props)
+        state, time_counter = sim.engine.state.copy(), sim.engine.time_counter.copy()
+        sim.init_cells()
+        sim.engine.state[...] = state
+        sim.engine.time_counter[...] = time_counter
+        sim.engine.refresh()
+        sim.counts = sim.engine.counts()
+    return sim
+
+def run_job(conn, run_id, spec, seed):
+    """Run one simulation, sending ("step", run_id, timestep, counts) after every step
+
+    Also sends ("frame", run_id, timestep, shape, bytes) every frame_every steps
+    with the state grid downsampled frame_scale times, and finally
+    ("done", run_id, status, summary). Between steps, ("pause" | "resume" |
+    "cancel", run_id) commands from conn are applied.
+    """
+    sim = make_run_simulation(spec, seed)
+    frame_every = spec.get("frame_every", 0)
+    frame_scale = max(spec.get("frame_scale", 1), 1)
+    parent = mp.parent_process()
+    paused = False
+    while sim.run_time > 0:
+        if not parent.is_alive():
+            sim.close()
+            return # Nobody is left to report to
+        while conn.poll() or paused:
+            if conn not in wait([conn, parent.sentinel]):
+                sim.close()
+                return
+            cmd, target = conn.recv()
+            if target != run_id:
+                continue # Meant for a run that already finished
+            if cmd == "cancel":
+                sim.close()
+                conn.send(("done", run_id, "cancelled", sim.stats.summary()))
+                return
+            paused = cmd == "pause" or (paused and cmd != "resume")
+            conn.send(("status", run_id, "paused" if paused else "running"))
+        sim.step()
+        conn.send(("step", run_id, sim.timestep, [int(n) for n in sim.counts]))
+        if frame_every > 0 and sim.timestep % frame_every == 0:
+            frame = np.ascontiguousarray(sim.engine.state[::frame_scale, ::frame_scale])
+            conn.send(("frame", run_id, sim.timestep, frame.shape, frame.tobytes()))
+    sim.close()
+    conn.send(("done", run_id, "done", sim.stats.summary()))
+
+def run_worker(conn):
+    """Worker process loop: run the jobs sent over conn one at a time until told to close or the service goes away"""
+    parent = mp.parent_process()
+    while True:
+        # Workers hold inherited copies of the service's pipe ends, so a service
+        # killed without close() never shows up as EOF; watch its sentinel too
+        if conn not in wait([conn, parent.sentinel]):
+            break
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg[0] == "close":
+            break
+        if msg[0] != "run":
+            continue # A command for a run that already finished
+        _, run_id, spec, seed = msg
+        try:
+            run_job(conn, run_id, spec, seed)
+        except Exception as e:
+            conn.send(("done", run_id, "failed", {"error" : repr(e)}))
+    conn.close()
+
+class Run(object):
+    """A submitted run: its status, the counts streamed so far and the clients following it"""
+
+    def __init__(self, run_id, spec, seed):
+        super(Run, self).__init__()
+        self.id = run_id
+        self.spec = spec
+        self.seed = seed
+        self.status = "queued"
+        self.history = [] # Counts after each step, replayed to clients that connect late
+        self.summary = None
+        self.worker = None
+        self.subscribers = set() # asyncio.Queues of events for connected clients
+
+    def info(self):
+        return {"id" : self.id, "seed" : self.seed, "status" : self.status, "timestep" : len(self.history),
+            "timesteps" : self.spec.get("timesteps", 1500), "counts" : dict(zip(COLUMNS, self.history[-1])) if self.history else None,
+            "summary" : self.summary}
+
+    def publish(self, event, data):
+        for queue in self.subscribers:
+            queue.put_nowait((event, data))
+
+class Service(object):
+    """Queues submitted runs onto a pool of long-lived worker processes and relays their progress
+
+    Each worker runs one simulation at a time and sends a message per step
+    over its pipe, which the event loop reads as it arrives. Clients follow a
+    run over server-sent events.
+    """
+
+    def __init__(self, n_workers=None):
+        super(Service, self).__init__()
+        self.runs = {}
+        self.queue = collections.deque()
+        self.ids = itertools.count()
+        self.workers = []
+        self.idle = []
+        self.loop = None
+        for i in range(n_workers or os.cpu_count() or 1):
+            self.add_worker()
+
+    def add_worker(self):
+        parent_conn, child_conn = mp.Pipe()
+        process = mp.Process(target=run_worker, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        self.workers.append((process, parent_conn))
+        self.idle.append(parent_conn)
+        if self.loop is not None:
+            self.loop.add_reader(parent_conn.fileno(), self.receive, parent_conn)
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        for _, conn in self.workers:
+            self.loop.add_reader(conn.fileno(), self.receive, conn)
+
+    def submit(self, spec):
+        """Queue one run per seed in spec["seeds"] (default [null], a fresh seed); returns the new runs"""
+        runs = []
+        for seed in spec.get("seeds", [None]):
+            run = Run(str(next(self.ids)), spec, seed)
+            self.runs[run.id] = run
+            self.queue.append(run)
+            runs.append(run)
+        self.dispatch()
+        return runs
+
+    def dispatch(self):
+        while self.queue and self.idle:
+            run = self.queue.popleft()
+            if run.status != "queued":
+                continue # Cancelled while queued
+            run.worker = self.idle.pop()
+            run.status = "running"
+            run.publish("status", {"status" : run.status})
+            self.send(run.worker, ("run", run.id, run.spec, run.seed))
+
+    def control(self, run, cmd):
+        """Pause, resume or cancel a run"""
+        if run.status in FINISHED:
+            return
+        if run.status == "queued":
+            if cmd == "cancel":
+                self.finish(run, "cancelled", None)
+            return
+        self.send(run.worker, (cmd, run.id))
+
+    def send(self, conn, msg):
+        try:
+            conn.send(msg)
+        except OSError:
+            self.lost(conn) # The reader may not have seen the EOF yet
+
+    def receive(self, conn):
+        """Handle every message waiting from a worker"""
+        while conn.poll():
+            try:
+                msg = conn.recv()
+            except EOFError:
+                self.lost(conn)
+                return
+            run = self.runs[msg[1]]
+            if msg[0] == "step":
+                run.history.append(msg[3])
+                run.publish("step", {"timestep" : msg[2], "counts" : dict(zip(COLUMNS, msg[3]))})
+            elif msg[0] == "frame":
+                run.publish("frame", {"timestep" : msg[2], "shape" : list(msg[3]), "state" : base64.b64encode(msg[4]).decode()})
+            elif msg[0] == "status":
+                run.status = msg[2]
+                run.publish("status", {"status" : run.status})
+            elif msg[0] == "done":
+                self.idle.append(conn)
+                self.finish(run, msg[2], msg[3])
+                self.dispatch()
+
+    def lost(self, conn):
+        """Replace a worker process that died, failing the run it had"""
+        if conn.closed:
+            return # Already replaced
+        self.loop.remove_reader(conn.fileno())
+        for process, worker_conn in self.workers:
+            if worker_conn is conn:
+                process.join()
+                self.workers.remove((process, worker_conn))
+                break
+        if conn in self.idle:
+            self.idle.remove(conn)
+        for run in self.runs.values():
+            if run.worker is conn and run.status not in FINISHED:
+                self.finish(run, "failed", {"error" : "worker process died"})
+        conn.close()
+        self.add_worker()
+        self.dispatch()
+
+    def finish(self, run, status, summary):
+        run.status = status
+        run.summary = summary
+        run.worker = None
+        run.publish("done", {"status" : status, "summary" : summary})
+
+    def close(self):
+        for process, conn in self.workers:
+            try:
+                conn.send(("close", None))
+            except OSError:
+                pass # Already gone
+        for process, conn in self.workers:
+            process.join()
+            conn.close()
+
+    async def handle(self, reader, writer):
+        """Serve one HTTP request"""
+        try:
+            method, path, body = await read_request(reader)
+        except (ValueError, asyncio.IncompleteReadError):
+            await respond(writer, 400, {"error" : "bad request"})
+            return
+
+        parts = [p for p in path.split("?")[0].split("/") if p]
+        if parts == ["runs"] and method == "POST":
+            try:
+                spec = json.loads(body or b"{}")
+            except ValueError:
+                spec = None
+            try:
+                check_spec(spec)
+            except ValueError as e:
+                await respond(writer, 400, {"error" : str(e)})
+                return
+            await respond(writer, 201, {"runs" : [run.info() for run in self.submit(spec)]})
+        elif parts == ["runs"] and method == "GET":
+            await respond(writer, 200, {"runs" : [run.info() for run in self.runs.values()]})
+        elif len(parts) >= 2 and parts[0] == "runs" and parts[1] in self.runs:
+            run = self.runs[parts[1]]
+            if len(parts) == 2 and method == "GET":
+                await respond(writer, 200, run.info())
+            elif len(parts) == 3 and parts[2] == "events" and method == "GET":
+                await self.stream(run, writer)
+            elif len(parts) == 3 and parts[2] in ("pause", "resume", "cancel") and method == "POST":
+                self.control(run, parts[2])
+                await respond(writer, 202, run.info())
+            else:
+                await respond(writer, 404, {"error" : "not found"})
+        else:
+            await respond(writer, 404, {"error" : "not found"})
+
+    async def stream(self, run, writer):
+        """Send a run's events to a client as server-sent events until it finishes or the client goes away"""
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        queue = asyncio.Queue()
+        run.subscribers.add(queue)
+        try:
+            write_event(writer, "status", {"status" : run.status})
+            for t, counts in enumerate(list(run.history)):
+                write_event(writer, "step", {"timestep" : t + 1, "counts" : dict(zip(COLUMNS, counts))})
+            if run.status in FINISHED:
+                write_event(writer, "done", {"status" : run.status, "summary" : run.summary})
+            else:
+                while True:
+                    event, data = await queue.get()
+                    write_event(writer, event, data)
+                    if queue.empty():
+                        await writer.drain()
+                    if event == "done":
+                        break
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            run.subscribers.discard(queue)
+            writer.close()
+
+async def read_request(reader):
+    """(method, path, body) of an HTTP/1.1 request"""
+    method, path, _ = (await reader.readuntil(b"\r\n")).decode("latin-1").split(" ", 2)
+    length = 0
+    while True:
+        line = (await reader.readuntil(b"\r\n")).decode("latin-1").strip()
+        if not line:
+            break
+        name, value = line.split(":", 1)
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    body = await reader.readexactly(length) if length else b""
+    return method, path, body
+
+async def respond(writer, code, data):
+    body = json.dumps(data).encode()
+    reasons = {200 : "OK", 201 : "Created", 202 : "Accepted", 400 : "Bad Request", 404 : "Not Found"}
+    writer.write(f"HTTP/1.1 {code} {reasons[code]}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode())
+    writer.write(body)
+    try:
+        await writer.drain()
+    except ConnectionError:
+        pass
+    writer.close()
+
+def write_event(writer, event, data):
+    writer.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+
+async def serve(service, host, port):
+    service.start()
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"Serving on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve simulation runs over a local HTTP API, streaming their progress as server-sent events.')
+    parser.add_argument("--host", type=str, help='address to listen on', default="127.0.0.1")
+    parser.add_argument("--port", type=int, help='port to listen on', default=8765)
+    parser.add_argument("--workers", type=int, help='number of worker processes, each running one simulation at a time (default: all cores)', default=None)
+
+    args = parser.parse_args()
+    service = Service(args.workers)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+if __name__ == '__main__':
+    main()
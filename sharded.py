@@ -0,0 +1,248 @@
+import numpy as np
+import multiprocessing as mp
+import os
+import threading
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+from contact import Stencil
+from engine import GridEngine, INFECTED, STREAMS
+
+BARRIER_TIMEOUT = 60 # Seconds a band waits at the halo barrier for the others before giving up
+SHARED_ARRAYS = [("state", np.uint8), ("time_counter", np.int16), ("resistance", np.float32)]
+
+class TileEngine(GridEngine):
+    """GridEngine for a band of rows [row0, row1) of a larger grid held in shared arrays
+
+    The contact stencil reads halos of its radius in rows above and below the
+    band, copied from the neighbouring bands (wrapping around the grid if the
+    stencil is periodic) by snapshot_halo before any band is updated.
+    Movement jumps are clamped to the full grid; swaps that stay inside the band
+    are applied here and the rest are handed back to the caller.
+    """
+
+    def __init__(self, grid_state, grid_time_counter, grid_resistance, row0, row1, params, contact, streams=None, grid_attributes=None, n_groups=0):
+        self.grid_state = grid_state
+        self.grid_rows = grid_state.shape[0]
+        self.row0 = row0
+        self.row1 = row1
+        self.halo_above = None
+        self.halo_below = None
+        super(TileEngine, self).__init__(grid_state[row0:row1], grid_resistance[row0:row1], params,
+            time_counter=grid_time_counter[row0:row1], streams=streams, contact=contact,
+            attributes={name : arr[row0:row1] for name, arr in (grid_attributes or {}).items()}, n_groups=n_groups)
+
+    def halo(self, rows):
+        """Infected mask of the given grid rows; rows off the grid wrap if the stencil is periodic, else are never infected"""
+        if self.contact.periodic:
+            return self.grid_state[rows % self.grid_rows] == INFECTED
+        inside = (rows >= 0) & (rows < self.grid_rows)
+        halo = np.zeros((len(rows), self.grid_state.shape[1]), dtype=bool)
+        halo[inside] = self.grid_state[rows[inside]] == INFECTED
+        return halo
+
+    def snapshot_halo(self):
+        r = self.contact.radius
+        self.halo_above = self.halo(np.arange(self.row0 - r, self.row0))
+        self.halo_below = self.halo(np.arange(self.row1, self.row1 + r))
+
+    def pad_infected(self, infected):
+        return self.contact.pad(np.concatenate([self.halo_above, infected, self.halo_below]), rows=False)
+
+    def movement_targets(self, to_move):
+        """Targets as flat indices relative to the band; rows outside it give indices outside [0, size)"""
+        cols = self.state.shape[1]
+        low, high = -self.max_movement_radius, self.max_movement_radius
+        jumps = self.streams["movement"].integers(low=low, high=high, size=(len(to_move), 2))
+
+        r, c = np.divmod(to_move, cols)
+        new_r = np.clip(self.row0 + r + jumps[:, 0], 0, self.grid_rows - 1) - self.row0
+        new_c = np.clip(c + jumps[:, 1], 0, cols - 1)
+        return new_r*cols + new_c
+
+    def movement_step(self, to_move):
+        """Apply the swaps inside the band; returns the (movers, targets) crossing it, as flat indices into the grid"""
+        targets = self.movement_targets(to_move)
+        inside = (targets >= 0) & (targets < self.state.size)
+        self.swap_cells(to_move[inside], targets[inside])
+
+        offset = self.row0*self.state.shape[1]
+        return to_move[~inside] + offset, targets[~inside] + offset
+
+def attach(specs, shape):
+    """Map the shared arrays given as (array name, block name, dtype); returns the SharedMemory blocks and {array name : array}"""
+    blocks = [shared_memory.SharedMemory(name=block_name) for _, block_name, _ in specs]
+    arrays = {name : np.ndarray(shape, dtype=dtype, buffer=block.buf) for block, (name, _, dtype) in zip(blocks, specs)}
+    return blocks, arrays
+
+def run_tile(specs, shape, row0, row1, params, contact, streams, n_groups, barrier, conn):
+    """Worker loop advancing one band of rows on command from ShardedEngine"""
+    blocks, arrays = attach(specs, shape)
+    core = [arrays.pop(name) for name, _ in SHARED_ARRAYS]
+    tile = TileEngine(*core, row0, row1, params, contact, streams, grid_attributes=arrays, n_groups=n_groups)
+    to_move = None
+    parent = mp.parent_process()
+    while True:
+        # Workers hold inherited copies of the parent's pipe ends, so a parent
+        # killed without close() never shows up as EOF; watch its sentinel too
+        if conn not in wait([conn, parent.sentinel]):
+            break
+        try:
+            cmd, arg = conn.recv()
+        except EOFError:
+            break
+        if cmd == "infection":
+            tile.snapshot_halo()
+            try:
+                barrier.wait(BARRIER_TIMEOUT) # No band may change before every band has copied its halo
+            except threading.BrokenBarrierError:
+                break # Another band died; the parent sees this worker's pipe close
+            counts, to_move = tile.infection_step()
+            conn.send((counts, tile.new_infections, tile.group_counts))
+        elif cmd == "movement":
+            conn.send(tile.movement_step(to_move))
+        elif cmd == "params":
+            tile.set_params(arg)
+        elif cmd == "contact":
+            tile.set_contact(arg)
+        elif cmd == "streams":
+            conn.send({name : rng.bit_generator.state for name, rng in tile.streams.items()})
+        elif cmd == "set_streams":
+            for name, state in arg.items():
+                tile.streams[name].bit_generator.state = state
+        elif cmd == "close":
+            break
+
+    del tile, core, arrays
+    for block in blocks:
+        block.close()
+    conn.close()
+
+class ShardedEngine(GridEngine):
+    """GridEngine whose grid lives in shared memory, split into bands of rows advanced by worker processes
+
+    Each step, every worker copies the halo rows its band needs from its
+    neighbours, waits for the others to do the same, then updates its band in
+    place and returns its counts, which are summed here. Workers apply the
+    movement swaps that stay inside their band; the few that cross a band
+    boundary are sent back and applied here on the full grid.
+
+    Every band draws from its own random streams, spawned from the ones given,
+    so runs are reproducible for a fixed seed and number of shards, but do not
+    match the single-process engines. stream_states() and set_stream_states()
+    let checkpoints save and restore the workers' streams as well.
+    """
+
+    def __init__(self, state, resistance, params, time_counter=None, a=1.625, b=1.625, streams=None, contact=None, attributes=None, n_groups=0, n_shards=None):
+        state = np.asarray(state)
+        if state.ndim != 2:
+            raise ValueError("ShardedEngine does not support replicates")
+        if contact is not None and not isinstance(contact, Stencil):
+            raise ValueError("ShardedEngine only supports stencil contacts")
+        rows = state.shape[0]
+        n_shards = min(n_shards or os.cpu_count() or 1, rows)
+        self.n_shards = n_shards
+
+        attributes = {name : np.asarray(arr) for name, arr in (attributes or {}).items()}
+        values = dict(attributes, state=state, time_counter=0 if time_counter is None else time_counter, resistance=resistance)
+        self.conns = []
+        self.blocks = []
+        self.workers = []
+        try:
+            specs = []
+            shared = {}
+            for name, dtype in SHARED_ARRAYS + [(name, arr.dtype) for name, arr in attributes.items()]:
+                block = shared_memory.SharedMemory(create=True, size=max(state.size*np.dtype(dtype).itemsize, 1))
+                self.blocks.append(block)
+                specs.append((name, block.name, np.dtype(dtype).str))
+                shared[name] = np.ndarray(state.shape, dtype=dtype, buffer=block.buf)
+                shared[name][...] = values[name]
+            super(ShardedEngine, self).__init__(shared["state"], shared["resistance"], params, time_counter=shared["time_counter"], a=a, b=b,
+                streams=streams, contact=contact, attributes={name : shared[name] for name in attributes}, n_groups=n_groups)
+
+            # Spawn per-band streams from the given ones; the parent streams stay usable
+            children = {name : self.streams[name].spawn(n_shards) for name in STREAMS}
+            bounds = np.linspace(0, rows, n_shards + 1).astype(int)
+            self.barrier = mp.Barrier(n_shards) # Kept alive here until every worker has unpickled it
+            for i in range(n_shards):
+                parent_conn, child_conn = mp.Pipe()
+                tile_streams = {name : children[name][i] for name in STREAMS}
+                worker = mp.Process(target=run_tile, args=(specs, state.shape, bounds[i], bounds[i + 1],
+                    params, self.contact, tile_streams, n_groups, self.barrier, child_conn), daemon=True)
+                worker.start()
+                child_conn.close()
+                self.conns.append(parent_conn)
+                self.workers.append(worker)
+        except BaseException:
+            # Nothing else will free the shared memory of an engine that failed to start
+            for worker in self.workers:
+                worker.terminate()
+            self.release_blocks()
+            raise
+
+    def set_params(self, params):
+        super(ShardedEngine, self).set_params(params)
+        for conn in self.conns:
+            conn.send(("params", params))
+
+    def set_contact(self, contact):
+        if not isinstance(contact, Stencil):
+            raise ValueError("ShardedEngine only supports stencil contacts")
+        super(ShardedEngine, self).set_contact(contact)
+        for conn in self.conns:
+            conn.send(("contact", contact))
+
+    def stream_states(self):
+        """Bit generator states of every band's streams, one {stream : state} dict per band"""
+        for conn in self.conns:
+            conn.send(("streams", None))
+        return [conn.recv() for conn in self.conns]
+
+    def set_stream_states(self, states):
+        if len(states) != len(self.conns):
+            raise ValueError(f"Have stream states for {len(states)} shards, not {len(self.conns)}")
+        for conn, state in zip(self.conns, states):
+            conn.send(("set_streams", state))
+
+    def infection_step(self):
+        """Advance every band by one timestep; movers are kept by the workers, so the returned to_move is None"""
+        for conn in self.conns:
+            conn.send(("infection", None))
+        replies = [conn.recv() for conn in self.conns]
+        self.new_infections = sum(n for _, n, _ in replies)
+        if self.n_groups:
+            self.group_counts = sum(group_counts for _, _, group_counts in replies)
+        return sum(counts for counts, _, _ in replies), None
+
+    def movement_step(self, to_move):
+        for conn in self.conns:
+            conn.send(("movement", None))
+        crossing = [conn.recv() for conn in self.conns]
+        movers = np.concatenate([m for m, _ in crossing])
+        targets = np.concatenate([t for _, t in crossing])
+        self.swap_cells(movers, targets)
+        return targets
+
+    def close(self):
+        """Stop the workers and free the shared memory; the arrays stay readable as private copies"""
+        if not self.workers:
+            return
+        for conn in self.conns:
+            conn.send(("close", None))
+        for worker in self.workers:
+            worker.join()
+        for conn in self.conns:
+            conn.close()
+        self.workers = []
+        self.conns = []
+
+        self.state = self.state.copy()
+        self.time_counter = self.time_counter.copy()
+        self.resistance = self.resistance.copy()
+        self.attributes = {name : arr.copy() for name, arr in self.attributes.items()}
+        self.release_blocks()
+
+    def release_blocks(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
@@ -0,0 +1,438 @@
+import numpy as np
+import argparse
+import json
+import os
+from datetime import datetime
+from checkpoint import Checkpointer
+from config import ConfigLogger
+from contact import ContactGraph, Stencil, load_contacts, moore
+from engine import ENGINES, GROUP, GridEngine, INFECTED, make_streams
+from logger import LOGGERS, group_columns
+from recorder import FrameRecorder
+from sharded import ShardedEngine
+from stats import RunStats, StopCondition
+from timing import NULL_TIMER, PhaseTimer
+
+SIM_ENGINES = dict(ENGINES, sharded=ShardedEngine) # Engines selectable with --engine
+PARAM_NAMES = ["max_latent", "max_infected", "prob_death", "max_immune", "max_movement_radius", "movement_prob"] # Keys of get_params()
+CONTACT_ARGS = {"radius" : "contact_radius", "a" : "contact_a", "b" : "contact_b", "kernel" : "contact_kernel", "graph" : "contact_graph", "periodic" : "periodic"}
+
+def parse_prop(value):
+    """Older configs saved props as stringified lists (e.g. "[0.5, 0.5]"); accept either form"""
+    if isinstance(value, str):
+        value = value[1:-1].split(", ")
+    return [float(s) for s in value]
+
+class Simulation(object):
+    """Headless simulation: owns the grid, parameters and logging, with no GUI dependencies"""
+
+    def __init__(self, log_path=None, run_time=1500, toolbar_size=40, cell_size=20, width=640, height=640, load_path="", num_sample=1, engine="grid", log_format="binary", resume=False, seed=None, shards=None):
+        super(Simulation, self).__init__()
+
+        self.streams = make_streams(seed)
+        self.run_time = run_time
+        self.timestep = 0
+        self.engine_mode = engine
+        self.shards = shards # Worker processes for the sharded engine (None for all cores)
+        self.log_path = log_path
+        self.log_format = log_format
+        self.record_settings = None
+        self.checkpoint_every = 0
+        self.stop_conditions = [] # StopConditions checked after every step
+        self.fast_forward_extinct = False # Fill in the remaining steps once no latent or infected cells are left
+        self.timer = NULL_TIMER # PhaseTimer to time each phase of a step (see profile())
+        self.num_sample = None # Cells infected at random in a generated starting grid; None if the grid was loaded
+
+        self.init_contact()
+        self.config_logger = ConfigLogger(self)
+        self.checkpointer = Checkpointer(self)
+        log_steps = None
+        if resume:
+            # Everything, including the remaining run time, comes from the checkpoint in log_path
+            meta = self.checkpointer.load(self.checkpoint_path)
+            self.log_format = meta["log_format"]
+            log_steps = meta["log_steps"]
+        elif load_path != "":
+            self.config_logger.load_config(os.path.join(load_path, "config.yml"))
+        else:
+            self.width = width
+            self.height = height + toolbar_size
+            self.modified_height = height
+
+            self.toolbar_size = toolbar_size
+
+            self.pause_bl_x = 20
+            self.pause_bl_y = toolbar_size*(1/5)
+
+            self.init_props()
+            self.init_time_params()
+
+            self.cell_size = cell_size
+            self.init_cells()
+            self.seed_infections(num_sample) # By default, the one person that is infected in the population at the start
+            self.num_sample = num_sample
+
+        self.engine.refresh()
+        self.counts = self.engine.counts()
+        self.stats = RunStats(self.engine.state.size, self.infectious_period)
+        self.logger = None
+        self.group_logger = None # Counts per demographic group, in groups.bin/groups.csv
+        if log_path is not None:
+            self.logger = LOGGERS[self.log_format](log_path, resume_at=log_steps)
+            self.group_logger = LOGGERS[self.log_format](log_path, resume_at=log_steps, name="groups", columns=group_columns(self.group_names()))
+            with open(os.path.join(log_path, "groups.json"), "w") as f:
+                json.dump({"groups" : self.group_names()}, f)
+        self.recorder = None
+
+        if resume:
+            if meta["record_settings"] is not None:
+                self.record_frames(resume=True, **meta["record_settings"])
+            if "stats" in meta:
+                self.stats.restore(meta["stats"])
+            self.checkpointer.restore_streams()
+
+    @property
+    def checkpoint_path(self):
+        return os.path.join(self.log_path, "checkpoint.npz")
+
+    @property
+    def grid_shape(self):
+        return (int(self.modified_height/self.cell_size), int(self.width/self.cell_size))
+
+    def init_time_params(self):
+        self.max_latent = 5
+        self.max_infected = 22
+        self.prob_death = 0.01/22
+        self.max_immune = 5
+        self.max_movement_radius = 2
+        self.movement_prob = 0.05
+
+    def init_contact(self):
+        # Infection contacts: a square stencil (or a kernel loaded from an .npy file), plus optional extra contacts from a file
+        self.contact_settings = {"radius" : 1, "a" : 1.625, "b" : 1.625, "periodic" : False, "kernel" : None, "graph" : None}
+
+    def make_contact(self):
+        settings = self.contact_settings
+        if settings["kernel"] is not None:
+            stencil = Stencil.from_kernel(np.load(settings["kernel"]), settings["periodic"])
+        else:
+            stencil = moore(settings["radius"], settings["a"], settings["b"], settings["periodic"])
+        if settings["graph"] is None:
+            return stencil
+        return ContactGraph.from_stencil(stencil, self.grid_shape) + load_contacts(settings["graph"], self.grid_shape)
+
+    def init_props(self):
+        self.mf_prop = [0.5, 0.5] # Proportion of males and females in the population
+        self.mf_influence = [0.5, 0.5] # Influence coefficent for males and females
+
+        self.age_prop = [1/5 for i in range(5)]
+        self.age_influence = [1/5 for i in range(5)]
+
+        self.expected_resistance = np.array(self.mf_prop).dot(self.mf_influence) * np.array(self.age_prop).dot(self.age_influence)
+
+    def group_names(self):
+        """One name per demographic group (sex and age group), in group index order"""
+        sexes = ["male", "female"] if len(self.mf_prop) == 2 else [f"sex{i}" for i in range(len(self.mf_prop))]
+        return [f"{sex}/age{j}" for sex in sexes for j in range(len(self.age_prop))]
+
+    def draw_population(self, rng, shape):
+        """(group, resistance) grids for a fresh population
+
+        Each cell's sex and age group are drawn together, as one categorical
+        draw of the group index sex*len(age_prop) + age with probability
+        mf_prop[sex]*age_prop[age]. Its resistance is
+        mf_influence[sex]*age_influence[age] times a uniform draw, which on
+        average is expected_resistance.
+        """
+        probs = np.outer(self.mf_prop, self.age_prop).ravel()
+        influence = np.outer(self.mf_influence, self.age_influence).ravel().astype(np.float32)
+        cdf = np.cumsum(probs)/probs.sum()
+        group = np.minimum(np.searchsorted(cdf, rng.random(shape, dtype=np.float32), side="right"), len(probs) - 1)
+        group = group.astype(np.min_scalar_type(len(probs) - 1))
+        resistance = influence[group]*rng.random(shape, dtype=np.float32)
+        return group, resistance
+
+    def init_cells(self, attributes=None):
+        """(Re)build the grid with every cell susceptible and a freshly drawn population
+
+        attributes are extra per-cell arrays for the engine to carry along
+        (e.g. when loading a saved grid); a group attribute given here replaces
+        the drawn groups.
+        """
+        shape = self.grid_shape
+        group, resistance = self.draw_population(self.streams["init"], shape)
+        attributes = dict(attributes or {})
+        attributes.setdefault(GROUP, group)
+        options = {"n_shards" : self.shards} if self.engine_mode == "sharded" else {}
+        if hasattr(self, "engine"):
+            self.engine.close()
+        self.engine = SIM_ENGINES[self.engine_mode](np.ones(shape), resistance, self.get_params(), streams=self.streams,
+            contact=self.make_contact(), attributes=attributes, n_groups=len(self.group_names()), **options)
+
+    def make_batch_engine(self, seeds):
+        """GridEngine advancing one replicate per seed, each following the same trajectory as a Simulation with that seed
+
+        If the grid was loaded (from a config or checkpoint), every replicate
+        starts from the current grid, population included. If it was generated,
+        each replicate draws its own population and infected cells from its own
+        init stream, as Simulation does, so edits made to the grid since are
+        not carried over.
+        """
+        streams = [make_streams(seed) for seed in seeds]
+        n = len(streams)
+        attributes = {name : np.repeat(arr[None], n, axis=0) for name, arr in self.engine.attributes.items()}
+        if self.num_sample is None:
+            state = np.repeat(self.engine.state[None], n, axis=0)
+            time_counter = np.repeat(self.engine.time_counter[None], n, axis=0)
+            resistance = np.repeat(self.engine.resistance[None], n, axis=0)
+        else:
+            state = np.ones((n,) + self.grid_shape, dtype=np.uint8)
+            time_counter = np.zeros(state.shape, dtype=np.int16)
+            resistance = np.zeros(state.shape, dtype=np.float32)
+            attributes[GROUP] = np.zeros(state.shape, dtype=self.engine.attributes[GROUP].dtype)
+            for i, s in enumerate(streams):
+                attributes[GROUP][i], resistance[i] = self.draw_population(s["init"], self.grid_shape)
+                state[i][self.infection_sites(s["init"], self.num_sample)] = INFECTED
+        return GridEngine(state, resistance, self.get_params(), time_counter=time_counter, streams=streams, contact=self.make_contact(),
+            attributes=attributes, n_groups=self.engine.n_groups)
+
+    def infection_sites(self, rng, num_sample):
+        """(rows, cols) of num_sample cells picked at random (with repeats) from rng"""
+        rows, cols = self.grid_shape
+        return rng.integers(rows, size=num_sample), rng.integers(cols, size=num_sample)
+
+    def seed_infections(self, num_sample):
+        self.set_cell_state(*self.infection_sites(self.streams["init"], num_sample), INFECTED)
+
+    def set_cell_state(self, row, col, state):
+        self.engine.state[row, col] = state
+        self.engine.time_counter[row, col] = 0
+
+    @property
+    def infectious_period(self):
+        """Steps a cell stays infected if it survives: its counter counts 0 to max_infected + 1, and it recovers the step after"""
+        return self.max_infected + 2
+
+    def get_params(self):
+        return {name : getattr(self, name) for name in PARAM_NAMES}
+
+    def get_config_no_grid(self):
+        params = self.get_params()
+        props = {"mf_prop" : self.mf_prop, "mf_influence" : self.mf_influence, "age_prop" : self.age_prop, "age_influence" : self.age_influence,
+            "expected_resistance" : self.expected_resistance}
+        settings = {"cell_size" : self.cell_size, "width" : self.width, "height" : self.height, "modified_height" : self.modified_height,
+            "toolbar_size" : self.toolbar_size, "pause_bl_x" : self.pause_bl_x, "pause_bl_y" : self.pause_bl_y}
+        props = {k: [float(x) for x in v] if isinstance(v, list) else float(v) for k,v in props.items()}
+        return {"params" : params, "props" : props, "settings" : settings, "contact" : dict(self.contact_settings)}
+
+    def set_params_from_config(self, params):
+        self.max_latent = params["max_latent"]
+        self.max_infected = params["max_infected"]
+        self.prob_death = params["prob_death"]
+        self.max_immune = params["max_immune"]
+        self.max_movement_radius = params["max_movement_radius"]
+        self.movement_prob = params["movement_prob"]
+        if hasattr(self, "engine"):
+            self.engine.set_params(self.get_params())
+        if hasattr(self, "stats"):
+            self.stats.infectious_period = self.infectious_period
+
+    def set_contact_from_config(self, contact):
+        """Update the contact settings (any subset of them), rebuilding the engine's contacts if it exists"""
+        self.contact_settings.update(contact)
+        if hasattr(self, "engine"):
+            self.engine.set_contact(self.make_contact())
+
+    def set_props_from_config(self, props):
+        self.mf_prop = parse_prop(props["mf_prop"])
+        self.mf_influence = parse_prop(props["mf_influence"])
+        self.age_prop = parse_prop(props["age_prop"])
+        self.age_influence = parse_prop(props["age_influence"])
+
+        if "expected_resistance" in props:
+            self.expected_resistance = float(props["expected_resistance"])
+        else:
+            self.expected_resistance = np.array(self.mf_prop).dot(self.mf_influence) * np.array(self.age_prop).dot(self.age_influence)
+
+    def set_settings_from_config(self, settings):
+        self.cell_size = settings["cell_size"]
+        self.width = settings["width"]
+        self.height = settings["height"]
+        self.modified_height = settings["modified_height"]
+        self.toolbar_size = settings["toolbar_size"]
+        self.pause_bl_x = settings["pause_bl_x"]
+        self.pause_bl_y = settings["pause_bl_y"]
+
+    def record_frames(self, path, every=1, counters=False, compress=False, resume=False):
+        """Save the state grid (and optionally time counters) every `every` steps, starting now
+
+        With resume, frames already recorded in path up to the current timestep are
+        kept and later ones discarded.
+        """
+        self.record_settings = {"path" : path, "every" : every, "counters" : counters, "compress" : compress}
+        if resume:
+            self.recorder = FrameRecorder(path, self.grid_shape, every, counters, compress, resume_at=self.timestep)
+        else:
+            self.recorder = FrameRecorder(path, self.grid_shape, every, counters, compress)
+            self.recorder.record(self.timestep, self.engine)
+
+    def profile(self):
+        """Start timing each phase of every step; the totals are saved to profile.json on close"""
+        self.timer = PhaseTimer()
+
+    def infection_step(self):
+        counts, to_move = self.engine.infection_step()
+        self.timer.lap("infection")
+        self.counts = counts
+        self.stats.update(counts, self.engine.new_infections)
+        self.timer.lap("stats")
+
+        if self.logger is not None:
+            self.logger.log(counts)
+            self.group_logger.log(self.engine.group_counts.ravel())
+            self.timer.lap("logging")
+
+        return to_move
+
+    def movement_step(self, to_move):
+        self.engine.movement_step(to_move)
+        self.timer.lap("movement")
+
+    def step(self):
+        self.timer.start()
+        to_move = self.infection_step()
+        self.movement_step(to_move)
+        self.run_time-=1
+        self.timestep+=1
+        if self.recorder is not None:
+            self.recorder.record(self.timestep, self.engine)
+            self.timer.lap("recording")
+        if self.checkpoint_every > 0 and self.timestep % self.checkpoint_every == 0:
+            self.checkpointer.save(self.checkpoint_path)
+            self.timer.lap("checkpoint")
+
+    def fast_forward(self):
+        """Finish the run in one go; only valid once no latent or infected cells are left"""
+        if self.run_time <= 0:
+            return
+        counts = self.engine.fast_forward(self.run_time)
+        for row, group_row in zip(counts, self.engine.group_counts):
+            if self.logger is not None:
+                self.logger.log(row)
+                self.group_logger.log(group_row.ravel())
+            self.stats.update(row, 0)
+        self.counts = counts[-1]
+        self.timestep += self.run_time
+        self.run_time = 0
+        if self.recorder is not None:
+            self.recorder.record(self.timestep, self.engine)
+
+    def stop_condition(self):
+        """The first of stop_conditions that holds, if any"""
+        for condition in self.stop_conditions:
+            if condition(self.stats):
+                return condition
+        return None
+
+    def advance(self):
+        """Take one step of the run, fast forwarding or stopping early as set; returns whether the run is over"""
+        self.step()
+        if self.fast_forward_extinct and self.stats.extinct:
+            self.fast_forward()
+            return True
+        condition = self.stop_condition()
+        if condition is not None:
+            print(f"Stopping at timestep {self.timestep}: {condition.spec}")
+            self.stats.stopped_by = condition.spec
+            return True
+        return self.run_time <= 0
+
+    def run(self):
+        while self.run_time > 0:
+            if self.advance():
+                break
+        self.close()
+
+    def close(self):
+        self.engine.close()
+        if self.log_path is not None:
+            self.stats.save(os.path.join(self.log_path, "stats.json"))
+        if isinstance(self.timer, PhaseTimer):
+            print(self.timer.summary())
+            if self.log_path is not None:
+                with open(os.path.join(self.log_path, "profile.json"), "w") as f:
+                    json.dump(self.timer.report(), f, indent=4)
+        if self.logger is not None:
+            self.logger.close()
+            self.group_logger.close()
+            self.logger = None
+            self.group_logger = None
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+def get_parser(description='Simulate disease spread.'):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--log_path", type=str, help='path to log simulation results', default=os.path.join("logs", datetime.now().strftime("log_%d_%m_%Y_%H_%M_%S")))
+    parser.add_argument("--timesteps", type=int, help='timesteps to run simulation', default=1500)
+    parser.add_argument("--init_config", type=str, help='path to init config file', default="")
+    parser.add_argument("--seed", type=int, help='random seed, for reproducible runs', default=None)
+    parser.add_argument("--log_format", type=str, help='binary (log.bin) or csv (log.csv); export binary logs with logger.py', choices=list(LOGGERS), default="binary")
+    parser.add_argument("--record_every", type=int, help='save the state grid to <log_path>/frames every K steps (0 to disable)', default=0)
+    parser.add_argument("--record_counters", help='also save time counters with each frame', default=False, action="store_true")
+    parser.add_argument("--record_compress", help='delta/zlib-compress recorded frames', default=False, action="store_true")
+    parser.add_argument("--checkpoint_every", type=int, help='save a checkpoint to <log_path>/checkpoint.npz every K steps (0 to disable)', default=0)
+    parser.add_argument("--resume", help='continue the run in --log_path from its last checkpoint', default=False, action="store_true")
+    parser.add_argument("--stop", nargs='+', help='stop early when any holds: extinction, stationary[:K] or e.g. infected>=1000, infections_per_cell>0.5', default=[])
+    parser.add_argument("--fast_forward", help='once no latent or infected cells are left, fill in the remaining steps without simulating them', default=False, action="store_true")
+    parser.add_argument("--engine", type=str, help='simulation engine; frontier only visits cells near the epidemic, calendar also skips cells waiting out their timers, sharded splits the grid across processes', choices=list(SIM_ENGINES), default="grid")
+    parser.add_argument("--shards", type=int, help='worker processes for the sharded engine (default: all cores; a resumed run keeps its own)', default=None)
+    parser.add_argument("--contact_radius", type=int, help='radius of the square neighbourhood each cell can be infected through', default=None)
+    parser.add_argument("--contact_a", type=float, help='infection coefficient for neighbours off the row/column axes (diagonals)', default=None)
+    parser.add_argument("--contact_b", type=float, help='infection coefficient for neighbours along the row/column axes', default=None)
+    parser.add_argument("--contact_kernel", type=str, help='.npy weight kernel to use instead of the square neighbourhood', default=None)
+    parser.add_argument("--contact_graph", type=str, help='extra contacts: .npy grid of group ids (e.g. households), or .npz/.csv edges src,dst[,weight]', default=None)
+    parser.add_argument("--periodic", help='wrap the contact neighbourhood around the grid edges', default=None, action="store_true")
+    parser.add_argument("--profile", help='time each phase of the step loop; prints a summary and saves <log_path>/profile.json', default=False, action="store_true")
+    parser.add_argument("--width", type=int, help='width of simulation window', default=32*20)
+    parser.add_argument("--height", type=int, help='height of simulation window', default=32*20)
+    return parser
+
+def make_simulation(args):
+    if args.resume:
+        sim = Simulation(args.log_path, resume=True, shards=args.shards)
+        set_run_options(sim, args)
+        return sim
+
+    # 549*20 = 10980 for Italy simulation
+    sim = Simulation(args.log_path, args.timesteps, width=args.width, height=args.height, load_path=args.init_config, engine=args.engine, log_format=args.log_format, seed=args.seed, shards=args.shards)
+    if args.record_every > 0:
+        sim.record_frames(os.path.join(args.log_path, "frames"), args.record_every, args.record_counters, args.record_compress)
+    contact = {name : getattr(args, arg) for name, arg in CONTACT_ARGS.items() if getattr(args, arg) is not None}
+    if contact:
+        try:
+            sim.set_contact_from_config(contact)
+        except ValueError:
+            sim.engine.close() # e.g. a contact graph the sharded engine rejects; frees its workers and shared memory
+            raise
+    set_run_options(sim, args)
+    return sim
+
+def set_run_options(sim, args):
+    sim.checkpoint_every = args.checkpoint_every
+    sim.stop_conditions = [StopCondition(spec) for spec in args.stop]
+    sim.fast_forward_extinct = args.fast_forward
+    if args.profile:
+        sim.profile()
+
+def main():
+    args = get_parser().parse_args()
+    print("Logging to: " + args.log_path)
+
+    sim = make_simulation(args)
+    sim.run()
+    summary = sim.stats.summary()
+    print(f"Peak infected {summary['peak_infected']} at timestep {summary['peak_step']}, {summary['infections_per_cell']:.3f} infections per cell")
+
+if __name__ == '__main__':
+    main()
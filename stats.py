@@ -0,0 +1,98 @@
+import json
+import operator
+import re
+from logger import COLUMNS
+
+OPERATORS = {">=" : operator.ge, "<=" : operator.le, ">" : operator.gt, "<" : operator.lt, "==" : operator.eq}
+
+class RunStats(object):
+    """Statistics of a run kept up to date as it steps, without storing its history
+
+    infectious_period is the number of steps a cell stays infected, used to
+    turn new infections per infected cell into an R_t estimate.
+    """
+
+    def __init__(self, population, infectious_period):
+        super(RunStats, self).__init__()
+        self.population = population
+        self.infectious_period = infectious_period
+        self.steps = 0
+        self.counts = None
+        self.peak_infected = 0
+        self.peak_step = 0
+        self.cumulative_infections = 0
+        self.rt = float("nan")
+        self.unchanged = 0 # Steps in a row with unchanged counts
+        self.stopped_by = None # Stop condition that ended the run early, if any
+
+    def update(self, counts, new_infections):
+        counts = dict(zip(COLUMNS, [int(n) for n in counts]))
+        self.steps += 1
+        if counts == self.counts:
+            self.unchanged += 1
+        else:
+            self.unchanged = 0
+        self.counts = counts
+
+        if counts["infected"] > self.peak_infected:
+            self.peak_infected = counts["infected"]
+            self.peak_step = self.steps
+        self.cumulative_infections += int(new_infections)
+        # New infections per infected cell per step, times the steps each stays infected
+        self.rt = new_infections/counts["infected"]*self.infectious_period if counts["infected"] > 0 else 0.0
+
+    @property
+    def infections_per_cell(self):
+        """Infections so far per cell; recovered cells can be reinfected, so this is not the fraction ever infected and can exceed 1"""
+        return self.cumulative_infections/self.population
+
+    @property
+    def extinct(self):
+        return self.counts is not None and self.counts["latent"] == 0 and self.counts["infected"] == 0
+
+    def value(self, name):
+        if name in COLUMNS:
+            return self.counts[name]
+        return getattr(self, name)
+
+    def summary(self):
+        return {"steps" : self.steps, "peak_infected" : self.peak_infected, "peak_step" : self.peak_step,
+            "cumulative_infections" : self.cumulative_infections, "infections_per_cell" : self.infections_per_cell, "rt" : self.rt,
+            "final" : self.counts, "stopped_by" : self.stopped_by}
+
+    def state(self):
+        return dict(self.__dict__)
+
+    def restore(self, state):
+        self.__dict__.update(state)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=4)
+
+class StopCondition(object):
+    """A condition on RunStats that ends a run early
+
+    Written as "extinction" (no latent or infected cells left),
+    "stationary[:K]" (counts unchanged for K steps, default 50) or a
+    comparison of a statistic with a value, e.g. "infected>=1000" or
+    "infections_per_cell>0.5".
+    """
+
+    def __init__(self, spec):
+        super(StopCondition, self).__init__()
+        self.spec = spec
+        if spec == "extinction":
+            self.test = lambda stats: stats.extinct
+        elif spec.startswith("stationary"):
+            k = int(spec.split(":")[1]) if ":" in spec else 50
+            self.test = lambda stats: stats.unchanged >= k
+        else:
+            match = re.fullmatch(r"(\w+)\s*(>=|<=|==|>|<)\s*([-+0-9.e]+)", spec)
+            if match is None:
+                raise ValueError("Cannot parse stop condition: " + spec)
+            name, op, value = match.group(1), OPERATORS[match.group(2)], float(match.group(3))
+            self.test = lambda stats: op(stats.value(name), value)
+
+    def __call__(self, stats):
+        return stats.counts is not None and bool(self.test(stats))
@@ -0,0 +1,106 @@
+import numpy as np
+import json
+import os
+import subprocess
+import sys
+import pytest
+from conftest import ROOT
+from engine import SUSCEPTIBLE
+from simulation import SIM_ENGINES, Simulation
+
+SIZE = 30
+TIMESTEPS = 200
+# An epidemic that dies out around step 100, with immunity outlasting it so there is still work to fast forward
+PARAMS = {"max_immune" : 60, "max_infected" : 6, "prob_death" : 0.01, "movement_prob" : 0.05}
+
+def make_sim(seed, log_path=None, engine="grid", timesteps=TIMESTEPS, **kwargs):
+    sim = Simulation(log_path, timesteps, cell_size=1, width=SIZE, height=SIZE, num_sample=3, engine=engine, seed=seed, **kwargs)
+    sim.set_params_from_config(dict(sim.get_params(), **PARAMS))
+    return sim
+
+def run_counts(sim):
+    counts = []
+    while sim.run_time > 0:
+        sim.step()
+        counts.append(sim.counts.copy())
+    sim.close()
+    return np.array(counts)
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def assert_same_run(path, expected_path):
+    """Two run directories hold identical logs and stats"""
+    for name in ["log.bin", "groups.bin"]:
+        assert read_bytes(os.path.join(path, name)) == read_bytes(os.path.join(expected_path, name)), name
+    with open(os.path.join(path, "stats.json")) as f, open(os.path.join(expected_path, "stats.json")) as g:
+        assert json.load(f) == json.load(g)
+
+def test_batch_matches_single_runs():
+    seeds = [11, 12, 13]
+    engine = make_sim(0).make_batch_engine(seeds)
+    counts = engine.run(TIMESTEPS)
+    for i, seed in enumerate(seeds):
+        np.testing.assert_array_equal(counts[i], run_counts(make_sim(seed)))
+
+@pytest.mark.parametrize("movement_prob", [0.0, 0.05])
+def test_calendar_matches_frontier(movement_prob):
+    sims = [make_sim(5, engine=engine) for engine in ["frontier", "calendar"]]
+    for t in range(TIMESTEPS):
+        if t == TIMESTEPS//2:
+            # Retimes every scheduled transition in the calendar
+            for sim in sims:
+                sim.set_params_from_config(dict(sim.get_params(), max_latent=2, max_immune=20, movement_prob=movement_prob))
+        for sim in sims:
+            sim.step()
+        frontier, calendar = [sim.engine for sim in sims]
+        np.testing.assert_array_equal(frontier.state, calendar.state)
+        np.testing.assert_array_equal(frontier.group_counts, calendar.group_counts)
+        timed = frontier.state != SUSCEPTIBLE
+        np.testing.assert_array_equal(frontier.time_counter[timed], calendar.time_counter[timed])
+    for sim in sims:
+        sim.close()
+
+@pytest.mark.parametrize("engine", ["grid", "frontier", "calendar"])
+def test_fast_forward_matches_full_run(tmp_path, engine):
+    full = make_sim(2, str(tmp_path / "full"), engine)
+    full.run()
+    fast = make_sim(2, str(tmp_path / "fast"), engine)
+    fast.fast_forward_extinct = True
+    fast.run()
+    assert fast.stats.extinct and fast.timestep == TIMESTEPS
+    assert_same_run(str(tmp_path / "fast"), str(tmp_path / "full"))
+    # Movement only permutes cells and is skipped, so the grids hold the same cells in other places
+    cells = [sorted(zip(sim.engine.state[sim.engine.state != SUSCEPTIBLE], sim.engine.time_counter[sim.engine.state != SUSCEPTIBLE]))
+        for sim in (fast, full)]
+    assert cells[0] == cells[1]
+
+KILLED_RUN = """
+import os, sys
+from test_equivalence import make_sim
+sim = make_sim(4, sys.argv[1], sys.argv[2], shards=2)
+sim.checkpoint_every = 25
+for t in range(int(sys.argv[3])):
+    sim.step()
+os._exit(1) # As if killed: nothing is closed or flushed
+"""
+
+@pytest.mark.parametrize("engine", list(SIM_ENGINES))
+@pytest.mark.parametrize("kill_at", [50, 83])
+def test_resume_after_kill_is_exact(tmp_path, engine, kill_at):
+    full = make_sim(4, str(tmp_path / "full"), engine, shards=2)
+    full.checkpoint_every = 25
+    full.run()
+
+    path = str(tmp_path / "resumed")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.path.dirname(__file__)]))
+    result = subprocess.run([sys.executable, "-c", KILLED_RUN, path, engine, str(kill_at)], env=env, cwd=ROOT)
+    assert result.returncode == 1
+    resumed = Simulation(path, resume=True)
+    assert resumed.timestep == 25*(kill_at//25)
+    resumed.run()
+
+    assert_same_run(path, str(tmp_path / "full"))
+    for name in ["state", "time_counter", "resistance"]:
+        np.testing.assert_array_equal(getattr(resumed.engine, name), getattr(full.engine, name))
@@ -0,0 +1,45 @@
+import time
+
+class PhaseTimer(object):
+    """Accumulates wall time per phase of the step loop
+
+    Call start() at the top of a step and lap(phase) at the end of each phase;
+    each lap is charged the time since the previous start or lap.
+    """
+
+    def __init__(self):
+        super(PhaseTimer, self).__init__()
+        self.totals = {}
+        self.calls = {}
+        self.last = time.perf_counter()
+
+    def start(self):
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.totals[phase] = self.totals.get(phase, 0.0) + now - self.last
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        self.last = now
+
+    def report(self):
+        """{phase : {"total", "calls", "mean"}} in seconds"""
+        return {phase : {"total" : total, "calls" : self.calls[phase], "mean" : total/self.calls[phase]} for phase, total in self.totals.items()}
+
+    def summary(self):
+        total = sum(self.totals.values()) or 1.0
+        lines = [f"{'phase':<12}{'calls':>8}{'mean ms':>12}{'share':>8}"]
+        for phase, stats in self.report().items():
+            lines.append(f"{phase:<12}{stats['calls']:>8}{1000*stats['mean']:>12.3f}{stats['total']/total:>8.1%}")
+        return "\n".join(lines)
+
+class NullTimer(object):
+    """Stands in for PhaseTimer when profiling is off; its methods do nothing"""
+
+    def start(self):
+        pass
+
+    def lap(self, phase):
+        pass
+
+NULL_TIMER = NullTimer()